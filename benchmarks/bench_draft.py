@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/bench_draft.py
+#
+# Wall time and output quality of draft mode (DCT scaled) jpeg decoding
+# compared to full decoding before the thumbnail resample.
+#
+# Usage (with fastclass installed): python benchmarks/bench_draft.py [-n 20]
+
+import argparse
+import math
+import tempfile
+import time
+
+from PIL import ImageChops, ImageStat
+
+from corpus import make_corpus
+from fastclass.imageprocessing import image_pad
+
+
+def psnr(a, b) -> float:
+    """Peak signal to noise ratio of two RGB images in dB"""
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(v**2 for v in ImageStat.Stat(diff).rms) / 3
+    return float("inf") if mse == 0 else 10 * math.log10(255**2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="draft mode benchmark")
+    parser.add_argument("-n", type=int, default=20, help="number of images")
+    parser.add_argument("-s", "--size", type=int, default=299, help="target size")
+    parser.add_argument(
+        "--width", type=int, default=4000, help="width of source images"
+    )
+    parser.add_argument(
+        "--height", type=int, default=3000, help="height of source images"
+    )
+    args = parser.parse_args()
+    size = (args.size, args.size)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = make_corpus(tmp, args.n, size=(args.width, args.height))
+
+        results = {}
+        for fast in [False, True]:
+            t0 = time.perf_counter()
+            images = [image_pad(f, size, fast=fast) for f in files]
+            results[fast] = (time.perf_counter() - t0) / len(files) * 1000, images
+
+    quality = [psnr(a, b) for a, b in zip(results[False][1], results[True][1])]
+    print(f"{args.n} images {args.width}x{args.height} -> {size}, ms per image")
+    print(f"  full decode   {results[False][0]:8.2f}")
+    print(f"  draft decode  {results[True][0]:8.2f}")
+    print(f"  speedup       {results[False][0] / results[True][0]:8.2f}x")
+    print(f"  PSNR draft vs full: mean {sum(quality) / len(quality):.1f} dB,")
+    print(f"                      min {min(quality):.1f} dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/bench_exif.py
+#
+# Per-image cost of resize() with and without embedding the source url,
+# compared to the former save/reload/save approach.
+#
+# Usage (with fastclass installed): python benchmarks/bench_exif.py [-n 200]
+
+import argparse
+import os
+import tempfile
+import time
+
+from PIL import Image
+import piexif
+import piexif.helper
+
+from corpus import make_corpus
+from fastclass.imageprocessing import resize_file, source_exif
+
+
+def legacy_embed(bg, out, url):
+    """Former approach: save, reload exif from disk, encode and save again"""
+    bg.save(out)
+    tag_data = piexif.helper.UserComment.dump("source: " + url)
+    exif_dict = piexif.load(out)
+    exif_dict["Exif"][piexif.ExifIFD.UserComment] = tag_data
+    bg.save(out, exif=piexif.dump(exif_dict))
+
+
+def timeit(fn, files):
+    t0 = time.perf_counter()
+    for f in files:
+        fn(f)
+    return (time.perf_counter() - t0) / len(files) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="resize/exif benchmark")
+    parser.add_argument("-n", type=int, default=200, help="number of images")
+    args = parser.parse_args()
+
+    size = (299, 299)
+    url = "https://example.com/images/guitar.jpg"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "raw")
+        out = os.path.join(tmp, "out")
+        os.makedirs(raw)
+        os.makedirs(out)
+        files = make_corpus(raw, args.n)
+
+        # encode only (image already resized in memory)
+        thumbs = {}
+        for f in files:
+            im = Image.open(f)
+            im.thumbnail(size, Image.ANTIALIAS)
+            thumbs[f] = im.convert("RGB")
+        dst = os.path.join(out, "x.jpg")
+
+        results = {
+            "resize (no source)": timeit(lambda f: resize_file(f, out, size), files),
+            "resize (source)": timeit(lambda f: resize_file(f, out, size, url), files),
+            "encode (no source)": timeit(lambda f: thumbs[f].save(dst), files),
+            "encode (source, single write)": timeit(
+                lambda f: thumbs[f].save(dst, exif=source_exif(url)), files
+            ),
+            "encode (source, legacy)": timeit(
+                lambda f: legacy_embed(thumbs[f], dst, url), files
+            ),
+        }
+
+    print(f"{args.n} images, ms per image")
+    for k, v in results.items():
+        print(f"  {k:32s} {v:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
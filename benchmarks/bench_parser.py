@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/bench_parser.py
+#
+# Throughput of GoogleParser on saved result pages, compared to the former
+# BeautifulSoup based parser. Pages default to benchmarks/fixtures/*.html
+# (synthetic, see corpus.google_page); saved real pages can be passed too.
+#
+# Usage (with fastclass installed): python benchmarks/bench_parser.py [pages]
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+from fastclass.googleparserfix import extract_urls
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def legacy_parse(content: bytes):
+    """Former parser: full soup, every script stringified, unbounded regex"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content.decode("utf-8", "ignore"), "lxml")
+    for div in soup.find_all(name="script"):
+        txt = str(div)
+        if "AF_initDataCallback" not in txt:
+            continue
+        if "ds:0" in txt or "ds:1" not in txt:
+            continue
+        return re.findall(r"http.*?\.(?:jpg|png|bmp)", txt)
+    return []
+
+
+def well_formed(urls) -> int:
+    return sum(1 for u in urls if not re.search(r"[\s\"'<>]", u))
+
+
+def timeit(fn, content: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(content)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="google parser benchmark")
+    parser.add_argument("pages", nargs="*", help="saved result pages (html)")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="runs per page")
+    parser.add_argument("-o", "--output", help="write results as json to this file")
+    args = parser.parse_args()
+
+    pages = args.pages or sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+    results = {}
+    for page in pages:
+        with open(page, "rb") as f:
+            content = f.read()
+        result = {"bytes": len(content)}
+        for name, fn in [("legacy", legacy_parse), ("bytes", extract_urls)]:
+            urls = fn(content)
+            seconds = timeit(fn, content, args.repeat)
+            result[name] = {
+                "ms": round(seconds * 1000, 4),
+                "mb_per_s": round(len(content) / 2**20 / seconds, 2),
+                "urls": len(urls),
+                "unique": len(set(urls)),
+                "well_formed": well_formed(urls),
+            }
+        results[os.path.basename(page)] = result
+
+        legacy, new = result["legacy"], result["bytes"]
+        print(f"{os.path.basename(page)} ({len(content) / 1024:.0f} kB)")
+        for name in ["legacy", "bytes"]:
+            r = result[name]
+            print(
+                f"  {name:8s} {r['ms']:9.3f} ms {r['mb_per_s']:9.1f} MB/s"
+                f"  {r['urls']:4d} urls, {r['unique']:4d} unique,"
+                f" {r['well_formed']:4d} well formed"
+            )
+        print(f"  speedup  {legacy['ms'] / new['ms']:9.1f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
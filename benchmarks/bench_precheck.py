@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/bench_precheck.py
+#
+# URLFilter against a local stand-in image server (no network): duplicate
+# urls, the header pre-check with range requests (206) and with servers
+# that ignore Range (200, connection closed early), and the bytes saved
+# compared to downloading every image.
+#
+# Usage (with fastclass installed): python benchmarks/bench_precheck.py [-n 40]
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from corpus import make_corpus
+from fastclass.urlfilter import URLFilter
+
+MIN_SIZE = (200, 200)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the pre-check closes connections once it has the header bytes
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(folder: str, ranges: bool):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        sent = 0
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def _write(self, data: bytes):
+            for i in range(0, len(data), 8192):
+                try:
+                    self.wfile.write(data[i : i + 8192])
+                except ConnectionError:
+                    # client got the header bytes it needed
+                    self.close_connection = True
+                    return
+                with Handler.lock:
+                    Handler.sent += len(data[i : i + 8192])
+
+        def do_GET(self):
+            path = os.path.join(folder, self.path.split("?")[0].lstrip("/"))
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                data = f.read()
+            match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+            if ranges and match:
+                a, b = int(match.group(1)), int(match.group(2))
+                part = data[a : b + 1]
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {a}-{a + len(part) - 1}/{len(data)}"
+                )
+                data = part
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self._write(data)
+
+    return Handler
+
+
+def check(folder: str, names, small, ranges: bool) -> dict:
+    """Run claim/precheck/release over all images of a stand-in server"""
+    handler = make_handler(folder, ranges)
+    server = Server(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/"
+    session = requests.Session()
+    try:
+        urls = URLFilter(precheck=True)
+        t0 = time.perf_counter()
+        rejected = {}
+        for name in names:
+            url = base + name
+            assert urls.claim(url), url
+            reason = urls.precheck(session, url, MIN_SIZE)
+            if reason is not None:
+                rejected[name] = reason
+        seconds = time.perf_counter() - t0
+        sent = handler.sent
+
+        # the same images again, with tracking parameters and another case
+        for name in names:
+            assert not urls.claim(base.upper() + name + "?utm_source=x")
+        # a failed download frees its url for another engine
+        urls.release(base + names[0])
+        assert urls.claim(base + names[0])
+
+        assert set(rejected) == set(small), sorted(rejected)
+        assert urls.duplicates == len(names) and urls.rejected == len(small)
+
+        # a size limit above every file is taken from Content-Range (206)
+        # or Content-Length (200)
+        too_large = URLFilter(precheck=True, min_bytes=2**30)
+        reasons = [too_large.precheck(session, base + n) for n in names]
+        assert all(r and r.endswith(" bytes") for r in reasons), reasons
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    return {"seconds": seconds, "sent": sent, "rejected": len(rejected)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="url filter pre-check benchmark")
+    parser.add_argument("-n", type=int, default=40, help="number of images")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for d in ["large", "small"]:
+            os.makedirs(os.path.join(tmp, d))
+        # every fourth image is below the minimum size of the crawlers
+        large = make_corpus(os.path.join(tmp, "large"), args.n - args.n // 4)
+        small = make_corpus(os.path.join(tmp, "small"), args.n // 4, size=(160, 120))
+        small = [os.path.relpath(f, tmp) for f in small]
+        names = sorted([os.path.relpath(f, tmp) for f in large] + small)
+        total = sum(os.path.getsize(os.path.join(tmp, n)) for n in names)
+
+        results = {
+            "range (206)": check(tmp, names, small, True),
+            "no range (200)": check(tmp, names, small, False),
+        }
+
+    print(f"{len(names)} images, {total / 2**20:.1f} MB if fully downloaded")
+    for k, r in results.items():
+        print(
+            f"  {k:16s} {r['rejected']:4d} rejected, "
+            f"{r['sent'] / 2**20:6.2f} MB sent, {r['seconds'] * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/bench_suite.py
+#
+# Offline timings of the fastclass hot paths on a synthetic corpus:
+# hashing, duplicate removal, resizing, padding, google result parsing,
+# fcc navigation and a complete fcd run with a local fake crawler.
+# Results are printed as a table and written as json (-o).
+#
+# Usage (with fastclass installed):
+#   python benchmarks/bench_suite.py [-n 200] [--dup-ratio 0.2] [-o out.json]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import PIL
+
+from corpus import FORMATS, google_page, make_corpus
+from fastclass.deduplicate import hashfile, remove_dups
+from fastclass.imageprocessing import image_pad, resize
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow progress bars and messages of the timed code"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        with contextlib.redirect_stderr(io.StringIO()):
+            yield
+
+
+def measure(fn, items: int, repeat: int, setup=None) -> dict:
+    """Best of repeat runs of fn() (setup() is not timed)"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with quiet():
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    best = min(times)
+    return {
+        "items": items,
+        "seconds": round(best, 6),
+        "median_seconds": round(statistics.median(times), 6),
+        "ms_per_item": round(best / max(items, 1) * 1000, 4),
+        "items_per_s": round(items / best, 2) if best > 0 else None,
+    }
+
+
+def refill(folder: str, files):
+    """Fresh copy of files in folder"""
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    for f in files:
+        shutil.copy(f, folder)
+
+
+def bench_google_parse(pages: int, urls: int, repeat: int) -> dict:
+    from fastclass.googleparserfix import GoogleParser
+
+    class Response(object):
+        content = google_page(urls)
+
+    parser = GoogleParser(1, None, None)
+    response = Response()
+    found = parser.parse(response)
+    assert len(found) >= urls, "google parser missed urls"
+
+    result = measure(
+        lambda: [parser.parse(response) for _ in range(pages)], pages, repeat
+    )
+    result["urls_per_page"] = urls
+    return result
+
+
+def bench_navigation(files, size, steps: int, prefetch: int, think: float) -> dict:
+    """Latency from a keystroke (label + forward) to the next image"""
+    from fastclass.fc_clean import ImageCache, ItemList
+
+    items = ItemList([Path(f) for f in files], size=size)
+    cache = ImageCache(size, capacity=4 * prefetch + 8) if prefetch else None
+    latencies = []
+    for _ in range(steps):
+        t0 = time.perf_counter()
+        items.set_label("1")
+        items.forward()
+        path = items.current.image_path
+        if cache is not None:
+            cache.get(path)
+            cache.prefetch([x.image_path for x in items.neighbours(prefetch)])
+        else:
+            image_pad(path, size)
+        latencies.append(time.perf_counter() - t0)
+        time.sleep(think)
+    latencies.sort()
+    return {
+        "items": steps,
+        "prefetch": prefetch,
+        "think_ms": think * 1000,
+        "median_ms": round(statistics.median(latencies) * 1000, 4),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4),
+    }
+
+
+def bench_fcd(files, workdir: str, per_engine: int, repeat: int) -> dict:
+    """Complete fcd run (2 classes x 2 engines) with a local fake crawler"""
+    import fastclass.fc_download as fd
+
+    def fake_engine(engine, folder, search, maxnum, offset, registry, sink=None, *_):
+        for i in range(maxnum):
+            src = files[(offset + i + len(search)) % len(files)]
+            name = f"{offset + i + 1:06d}{os.path.splitext(src)[1]}"
+            path = os.path.join(folder, name)
+            shutil.copy(src, path)
+            url = f"https://{engine.lower()}.example.com/{search}/{i}.jpg"
+            registry.add(engine, name, url, os.path.getsize(path))
+            if sink is not None:
+                sink.put(path, url)
+
+    outpath = os.path.join(workdir, "dataset")
+
+    def setup():
+        for p in os.listdir(workdir):
+            shutil.rmtree(os.path.join(workdir, p), ignore_errors=True)
+
+    def run():
+        infile = io.StringIO("searchterm,folder\nred guitar,guitar\ngreen leaves\n")
+        fd.main(infile, 299, ["GOOGLE", "BING"], False, per_engine, outpath)
+
+    original = fd._crawl_engine
+    fd._crawl_engine = fake_engine
+    try:
+        return measure(run, 4 * per_engine, repeat, setup=setup)
+    finally:
+        fd._crawl_engine = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fastclass benchmark suite")
+    parser.add_argument("-n", type=int, default=200, help="number of images")
+    parser.add_argument("--width", type=int, default=1200, help="image width")
+    parser.add_argument("--height", type=int, default=900, help="image height")
+    parser.add_argument("--format", default="jpg", choices=sorted(FORMATS))
+    parser.add_argument(
+        "--dup-ratio", type=float, default=0.2, help="fraction of duplicates"
+    )
+    parser.add_argument("-s", "--size", type=int, default=299, help="target size")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--only", action="append", help="run only these stages (repeatable)"
+    )
+    parser.add_argument("-o", "--output", help="write results as json to this file")
+    args = parser.parse_args()
+    size = (args.size, args.size)
+
+    results = {}
+
+    def stage(name):
+        return not args.only or name in args.only
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "raw")
+        work = os.path.join(tmp, "work")
+        out = os.path.join(tmp, "out")
+        for d in [raw, out]:
+            os.makedirs(d)
+        files = make_corpus(
+            raw,
+            args.n,
+            size=(args.width, args.height),
+            fmt=args.format,
+            dup_ratio=args.dup_ratio,
+            seed=args.seed,
+        )
+        n = len(files)
+
+        if stage("hashfile"):
+            results["hashfile"] = measure(
+                lambda: [hashfile(f) for f in files], n, args.repeat
+            )
+        for method in ["md5", "phash"]:
+            if stage(f"remove_dups_{method}"):
+                results[f"remove_dups_{method}"] = measure(
+                    lambda: remove_dups(work, method=method),
+                    n,
+                    args.repeat,
+                    setup=lambda: refill(work, files),
+                )
+        for workers in [1, 0]:
+            for fast in [False, True]:
+                name = f"resize_w{workers}{'_fast' if fast else ''}"
+                if stage(name):
+                    results[name] = measure(
+                        lambda: resize(files, out, size, workers=workers, fast=fast),
+                        n,
+                        args.repeat,
+                    )
+        if stage("image_pad"):
+            results["image_pad"] = measure(
+                lambda: [image_pad(f, size) for f in files], n, args.repeat
+            )
+        if stage("google_parse"):
+            results["google_parse"] = bench_google_parse(20, 100, args.repeat)
+        for prefetch in [0, 5]:
+            name = f"fcc_navigation_p{prefetch}"
+            if stage(name):
+                results[name] = bench_navigation(
+                    files, size, min(n, 100), prefetch, think=0.02
+                )
+        if stage("fcd_fake_crawl"):
+            os.makedirs(work, exist_ok=True)
+            results["fcd_fake_crawl"] = bench_fcd(
+                files, work, max(n // 8, 1), args.repeat
+            )
+
+    report = {
+        "config": vars(args),
+        "platform": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+    print(f"{n} images {args.width}x{args.height} ({args.format}) -> {size}")
+    for name, r in results.items():
+        if "ms_per_item" in r:
+            print(f"  {name:24s} {r['ms_per_item']:10.3f} ms/item")
+        else:
+            print(
+                f"  {name:24s} {r['median_ms']:10.3f} ms median, "
+                f"{r['p95_ms']:.3f} ms p95"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+# fastclass - benchmarks/corpus.py
+#
+# Synthetic image corpora for the benchmarks (reproducible, no network)
+
+import os
+import random
+import shutil
+from typing import List, Tuple
+
+from PIL import Image
+
+FORMATS = {"jpg": "JPEG", "png": "PNG", "tif": "TIFF"}
+
+
+def make_corpus(
+    folder: str,
+    n: int,
+    size: Tuple[int, int] = (1200, 900),
+    fmt: str = "jpg",
+    dup_ratio: float = 0.0,
+    seed: int = 0,
+) -> List[str]:
+    """Create n noisy images of size in folder, returns the sorted paths
+
+    A fraction dup_ratio of the files duplicates an earlier image: every
+    second one is a byte identical copy, the others are re-encoded at 90%
+    size (near duplicates for the perceptual hashes).
+    """
+    rng = random.Random(seed)
+    ndups = int(n * dup_ratio)
+    originals = n - ndups
+    files = []
+    for i in range(originals):
+        im = Image.effect_noise((size[0] // 8, size[1] // 8), 64 + i % 32)
+        im = im.resize(size).convert("RGB")
+        path = os.path.join(folder, f"{i:06d}.{fmt}")
+        im.save(path, FORMATS[fmt])
+        files.append(path)
+
+    for i in range(originals, n):
+        src = files[rng.randrange(originals)]
+        path = os.path.join(folder, f"{i:06d}.{fmt}")
+        if i % 2 == 0:
+            shutil.copyfile(src, path)
+        else:
+            im = Image.open(src)
+            im.resize((im.width * 9 // 10, im.height * 9 // 10)).save(
+                path, FORMATS[fmt]
+            )
+        files.append(path)
+    return files
+
+
+def google_page(n: int, seed: int = 0) -> bytes:
+    """Synthetic google image result page with n image urls in ds:1
+
+    Mimics the layout the GoogleParser relies on: markup and unrelated
+    scripts, a ds:0 callback and the ds:1 callback whose data holds every
+    url twice (thumbnail entry and full entry) next to non-image links.
+    """
+    rng = random.Random(seed)
+    exts = ["jpg", "jpg", "jpg", "png", "bmp"]
+    entries = []
+    for i in range(n):
+        url = f"https://img{i % 7}.example.com/{rng.getrandbits(40):x}/photo_{i}"
+        url += "." + exts[i % len(exts)]
+        entries.append(
+            f'[1,[null,"https://encrypted-tbn0.gstatic.com/images?q\\u003dtbn:{i}",'
+            f'180,135],["{url}",1200,900],null,0,"rgb(12,34,56)",null,0,'
+            f'{{"2003":[null,"{rng.getrandbits(32):x}","https://example.org/page/{i}",'
+            f'"Guitar {i} - Example","{url}"]}}]'
+        )
+    scripts = "".join(
+        f'<script nonce="x">(function(){{var s{i}={{"k":"{"v" * 200}"}};}})();'
+        "</script>"
+        for i in range(80)
+    )
+    markup = '<div class="isv-r"><a href="/imgres?x=1"><img alt="guitar"></a></div>'
+    return (
+        "<!doctype html><html><head><title>guitar - Google Search</title></head>"
+        f"<body><div id=islrg>{markup * 400}</div>{scripts}"
+        "<script>AF_initDataCallback({key: 'ds:0', isError: false, hash: '1', "
+        'data:function(){return [null,"https://www.google.com/logo.png"]}});'
+        "</script><script>AF_initDataCallback({key: 'ds:1', isError: false, "
+        f"hash: '2', data:function(){{return [null,[{','.join(entries)}]]}}}});"
+        "</script></body></html>"
+    ).encode("utf-8")
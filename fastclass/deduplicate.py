@@ -4,15 +4,24 @@
 #
 # Christian Werner, 2018-10-27
 
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache, partial
 import hashlib
+import math
 import os
+from PIL import Image
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from .misc import flatten
 
 
-def hashfile(path: str, blocksize: int = 65536) -> str:
-    """Create hash for file"""
+def hashfile(path: str, blocksize: int = 65536, limit: Optional[int] = None) -> str:
+    """Create hash for file (or its first limit bytes)"""
     with open(path, "rb") as f:
         hasher = hashlib.md5()
+        if limit is not None:
+            hasher.update(f.read(limit))
+            return hasher.hexdigest()
         buf = f.read(blocksize)
         while len(buf) > 0:
             hasher.update(buf)
@@ -20,15 +29,219 @@ def hashfile(path: str, blocksize: int = 65536) -> str:
     return hasher.hexdigest()
 
 
-def remove_dups(parent_folder: str, match: str = None):
-    """Remove duplicate files"""
-    dups = {}
+def _grayscale(path: str, size: Tuple[int, int]) -> List[int]:
+    """Read image as downscaled grayscale pixel list"""
+    im = Image.open(path)
+    # let the jpeg decoder do most of the downscaling
+    im.draft("L", (size[0] * 4, size[1] * 4))
+    im = im.convert("L").resize(size, Image.ANTIALIAS)
+    return list(im.getdata())
+
+
+def _to_int(bits) -> int:
+    """Pack iterable of bools into integer"""
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def ahash(path: str, hash_size: int = 8) -> int:
+    """Average hash: pixels brighter than the mean"""
+    pixels = _grayscale(path, (hash_size, hash_size))
+    mean = sum(pixels) / len(pixels)
+    return _to_int(p > mean for p in pixels)
+
+
+def dhash(path: str, hash_size: int = 8) -> int:
+    """Difference hash: horizontal gradient between neighbouring pixels"""
+    w = hash_size + 1
+    pixels = _grayscale(path, (w, hash_size))
+    return _to_int(
+        pixels[r * w + c] < pixels[r * w + c + 1]
+        for r in range(hash_size)
+        for c in range(hash_size)
+    )
+
+
+@lru_cache(maxsize=None)
+def _dct_table(n: int, k: int) -> Tuple[Tuple[float, ...], ...]:
+    """Cosine table of the k lowest DCT-II frequencies for n samples"""
+    return tuple(
+        tuple(math.cos(math.pi * (2 * x + 1) * u / (2 * n)) for x in range(n))
+        for u in range(k)
+    )
+
+
+def phash(path: str, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """Perceptual hash: low frequency DCT coefficients above their median"""
+    n = hash_size * highfreq_factor
+    pixels = _grayscale(path, (n, n))
+    table = _dct_table(n, hash_size)
+
+    # separable DCT, only the low frequencies are computed
+    rows = [pixels[r * n : (r + 1) * n] for r in range(n)]
+    rows = [[sum(c * p for c, p in zip(cu, row)) for cu in table] for row in rows]
+    coeffs = [
+        sum(c * rows[y][u] for y, c in enumerate(cv))
+        for cv in table
+        for u in range(hash_size)
+    ]
+    median = sorted(coeffs)[len(coeffs) // 2]
+    return _to_int(c > median for c in coeffs)
+
+
+HASHES: Dict[str, Callable[[str], int]] = {
+    "ahash": ahash,
+    "dhash": dhash,
+    "phash": phash,
+}
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits"""
+    return bin(a ^ b).count("1")
+
+
+class BKTree(object):
+    """Burkhard-Keller tree for radius queries in Hamming space
+
+    Lookups only descend into children whose edge distance lies within
+    the query radius, so the tree avoids comparing every pair of hashes.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key: int, item: Any = None):
+        self._size += 1
+        node = [key, item, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            d = hamming(key, current[0])
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, key: int, radius: int) -> List[Tuple[int, Any]]:
+        """Return (distance, item) for all keys within radius"""
+        found = []
+        if self._root is None:
+            return found
+        stack = [self._root]
+        while stack:
+            node_key, item, children = stack.pop()
+            d = hamming(key, node_key)
+            if d <= radius:
+                found.append((d, item))
+            for dist, child in children.items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def _split_groups(
+    groups: List[List[str]], keyfunc: Callable[[str], Any], executor: Executor
+) -> List[List[str]]:
+    """Split groups of paths by keyfunc, keep only groups with collisions"""
+    items = [(gid, path) for gid, group in enumerate(groups) for path in group]
+    keys = executor.map(keyfunc, [path for _, path in items])
+    split = {}
+    for (gid, path), key in zip(items, keys):
+        split.setdefault((gid, key), []).append(path)
+    return [group for group in split.values() if len(group) > 1]
+
+
+def _exact_dups(paths: List[str], executor: Executor, head: int = 4096) -> List[str]:
+    """Find byte-identical files in stages: size, first head bytes, full md5"""
+    sizes = {}
+    for path in paths:
+        sizes.setdefault(os.stat(path).st_size, []).append(path)
+    groups = [group for group in sizes.values() if len(group) > 1]
+
+    groups = _split_groups(groups, partial(hashfile, limit=head), executor)
+
+    # files up to head bytes are already fully hashed
+    small = [g for g in groups if os.path.getsize(g[0]) <= head]
+    large = [g for g in groups if os.path.getsize(g[0]) > head]
+    groups = small + _split_groups(large, hashfile, executor)
+
+    return list(flatten([sorted(group)[1:] for group in groups]))
+
+
+def _near_dups(
+    paths: List[str], method: str, threshold: int, executor: Executor
+) -> List[str]:
+    """Find images within threshold bits of an already seen image"""
+
+    def safe_hash(path):
+        try:
+            return HASHES[method](path)
+        except OSError:
+            # not an image (or truncated), leave it to later stages
+            return None
+
+    tree = BKTree()
+    dups = []
+    for path, h in zip(paths, executor.map(safe_hash, paths)):
+        if h is None:
+            continue
+        if tree.search(h, threshold):
+            dups.append(path)
+        else:
+            tree.add(h, path)
+    return dups
+
+
+def remove_dups(
+    parent_folder: str,
+    match: str = None,
+    method: str = "md5",
+    threshold: int = 4,
+    workers: int = 8,
+    index=None,
+    label: Optional[str] = None,
+):
+    """Remove duplicate files
+
+    method "md5" removes byte-identical files, "ahash", "dhash" and "phash"
+    remove images within a Hamming distance of threshold bits of an image
+    seen before (in sorted path order). Hashing runs in a pool of workers
+    threads. With a HashIndex, files already processed into an existing
+    output of another class (or an earlier run) are removed as well.
+    """
+    paths = []
     for dirName, subdirs, files in os.walk(parent_folder):
         for f in files:
-            path = os.path.join(dirName, f)
-            dups.setdefault(hashfile(path), []).append(path)
-    dups = flatten([v[1:] for k, v in dups.items() if len(v) > 1])
+            paths.append(os.path.join(dirName, f))
+    paths.sort()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        if method == "md5":
+            dups = _exact_dups(paths, executor)
+        else:
+            dups = _near_dups(paths, method, threshold, executor)
 
-    print(f"Number of duplicate image files: {len(list(dups))}. Removing...")
+        known = []
+        if index is not None:
+            remaining = sorted(set(paths) - set(dups))
+            digests = executor.map(index.digest, remaining)
+            known = [p for p, d in zip(remaining, digests) if index.known(d, label)]
+
+    print(f"Number of duplicate image files: {len(dups)}. Removing...")
     for dup in dups:
         os.remove(dup)
+
+    if index is not None:
+        print(f"Number of image files already in index: {len(known)}. Removing...")
+        for path in known:
+            os.remove(path)
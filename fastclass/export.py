@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# fastclass - export.py
+#
+# Packed dataset export: WebDataset style tar shards or a flat uint8 array
+
+import io
+import json
+import os
+import tarfile
+import threading
+from typing import Any, Optional, Tuple
+
+from PIL import Image
+
+FORMATS = ["tar", "array"]
+
+
+class TarShardWriter(object):
+    """Write images into tar shards of shard_size samples each
+
+    Every sample is stored as <key>.jpg, <key>.cls (label) and, if known,
+    <key>.txt (source url), the layout WebDataset style loaders expect.
+    """
+
+    def __init__(self, folder: str, shard_size: int = 1000):
+        self.folder = folder
+        self.shard_size = shard_size
+        self.count = 0
+        self._lock = threading.Lock()
+        self._tar = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _member(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add(self, path: str, label: str, source: Optional[str] = None):
+        with open(path, "rb") as f:
+            data = f.read()
+        name, _ = os.path.splitext(os.path.basename(path))
+        with self._lock:
+            if self.count % self.shard_size == 0:
+                if self._tar is not None:
+                    self._tar.close()
+                shard = f"shard-{self.count // self.shard_size:06d}.tar"
+                self._tar = tarfile.open(os.path.join(self.folder, shard), "w")
+            key = f"{label}/{name}"
+            self._member(key + ".jpg", data)
+            self._member(key + ".cls", label.encode("utf-8"))
+            if source:
+                self._member(key + ".txt", source.encode("utf-8"))
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+
+
+class ArrayWriter(object):
+    """Append fixed size RGB images to a raw uint8 file
+
+    images.u8 holds count x height x width x 3 bytes, images.json the shape
+    and index.csv the label, file and source of every row, so data loaders
+    can memory-map the file and slice batches without decoding (load_array).
+    """
+
+    def __init__(self, folder: str, size: Tuple[int, int]):
+        if size[0] <= 0 or size[1] <= 0:
+            raise ValueError("array export requires a fixed image size")
+        self.folder = folder
+        self.size = size
+        self.count = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._data = open(os.path.join(folder, "images.u8"), "wb")
+        self._index = open(os.path.join(folder, "index.csv"), "w", encoding="utf-8")
+        self._index.write("row,label,image,source\n")
+
+    def add(self, path: str, label: str, source: Optional[str] = None):
+        im = Image.open(path).convert("RGB")
+        if im.size != self.size:
+            raise ValueError(f"{path} has size {im.size}, expected {self.size}")
+        self.add_pixels(im.tobytes(), os.path.basename(path), label, source)
+
+    def add_pixels(
+        self, data: bytes, name: str, label: str, source: Optional[str] = None
+    ):
+        """Append one image given as raw RGB bytes"""
+        with self._lock:
+            self._data.write(data)
+            self._index.write(f"{self.count},{label},{name},{source or ''}\n")
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+            meta = {
+                "count": self.count,
+                "height": self.size[1],
+                "width": self.size[0],
+                "channels": 3,
+                "dtype": "uint8",
+            }
+            with open(os.path.join(self.folder, "images.json"), "w") as f:
+                json.dump(meta, f, indent=1)
+
+
+def create_exporter(fmt: str, folder: str, size: Tuple[int, int], **kwargs) -> Any:
+    """Writer for export format fmt ("tar" or "array")"""
+    if fmt == "tar":
+        return TarShardWriter(folder, **kwargs)
+    if fmt == "array":
+        return ArrayWriter(folder, size)
+    raise ValueError(f"Unknown export format {fmt}")
+
+
+def load_array(folder: str) -> Tuple[Any, list]:
+    """Memory-map an array export, returns (images, index rows)
+
+    images is a read-only numpy memmap of shape (count, height, width, 3).
+    """
+    import numpy as np
+
+    with open(os.path.join(folder, "images.json")) as f:
+        meta = json.load(f)
+    shape = (meta["count"], meta["height"], meta["width"], meta["channels"])
+    images = np.memmap(
+        os.path.join(folder, "images.u8"), dtype=meta["dtype"], mode="r", shape=shape
+    )
+    with open(os.path.join(folder, "index.csv"), encoding="utf-8") as f:
+        rows = [line.rstrip("\n").split(",", 3) for line in f][1:]
+    return images, rows
@@ -5,16 +5,17 @@
 # Christian Werner, 2018-10-23
 
 import click
-from collections import deque
+from collections import OrderedDict
 from functools import partial
-import itertools as it
 import os
 from pathlib import Path
 from PIL import ImageTk, Image
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
-import shutil
 
+from .fileops import MODES, TransferPool
 from .imageprocessing import image_pad
 
 EPILOG = """::: FastClass fcc :::\r
@@ -37,54 +38,335 @@ vs the total number in the input folder.\r
 In the output csv file 1,2 indicate class assignments/ ratings, 
 -1 indicates files marked for deletion (if not excluded with -d)."""
 
-# supported suffixes
-suffixes = ["jpg", "jpeg", "png", "tif", "tiff"]
-suffixes += [x.upper() for x in suffixes]
+# supported suffixes (matched case-insensitive)
+suffixes = {"jpg", "jpeg", "png", "tif", "tiff"}
 
 digits = "123456789"
 
 
+class ImageCache(object):
+    """Bounded LRU cache of padded images, filled by a background thread
+
+    Decoding and padding happens in a prefetch thread, so the Tk event loop
+    only has to wrap the cached PIL image into a PhotoImage.
+    """
+
+    def __init__(self, size=(299, 299), capacity=64, fast=True):
+        self.size = size
+        self.capacity = capacity
+        self.fast = fast
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+    def _load(self, path):
+        im = image_pad(path, self.size, self.fast)
+        im.load()
+        return im
+
+    def _insert(self, path, im):
+        with self._lock:
+            self._images[path] = im
+            self._images.move_to_end(path)
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+
+    def get(self, path):
+        """Return padded image (decoded synchronously on a cache miss)"""
+        with self._lock:
+            im = self._images.get(path)
+            if im is not None:
+                self._images.move_to_end(path)
+                return im
+        im = self._load(path)
+        self._insert(path, im)
+        return im
+
+    def prefetch(self, paths):
+        """Replace pending requests by paths (most important first)"""
+        try:
+            while True:
+                self._requests.get_nowait()
+        except queue.Empty:
+            pass
+        for path in paths:
+            self._requests.put(path)
+
+    def _work(self):
+        while True:
+            path = self._requests.get()
+            if path in self:
+                continue
+            try:
+                self._insert(path, self._load(path))
+            except Exception:
+                # broken files are reported when they are displayed, the
+                # thread keeps serving the other requests
+                pass
+
+
 class Item(object):
-    def __init__(self, image_path, size):
+    __slots__ = ("image_path", "label", "size")
+
+    def __init__(self, image_path, size, label=None):
         self.image_path = image_path
-        self.label = None
+        self.label = label
         self.size = size
 
     def __repr__(self):
         return f"Item <{self.image_path} [{self.label if self.label else None}]>"
 
-    def show(self):
+    def show(self, cache=None):
+        if cache is not None:
+            return ImageTk.PhotoImage(cache.get(self.image_path))
         return ImageTk.PhotoImage(image_pad(self.image_path, self.size))
 
 
+def scan_images(folder, batch=1000):
+    """Yield batches of image paths in folder (single os.scandir pass)"""
+    paths = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            _, ext = os.path.splitext(entry.name)
+            if ext[1:].lower() in suffixes and entry.is_file():
+                paths.append(Path(entry.path))
+                if len(paths) >= batch:
+                    yield paths
+                    paths = []
+    if paths:
+        yield paths
+
+
+class LabelJournal(object):
+    """Append-only journal of label assignments for crash-safe sessions
+
+    Every assignment is appended as "name;label" and flushed, which is cheap
+    compared to rewriting a report. After compact_every records the file
+    is rewritten atomically with only the latest label per image. Records
+    after close() are ignored.
+    """
+
+    def __init__(self, path, compact_every=500):
+        self.path = Path(path)
+        self.compact_every = compact_every
+        self.labels = self.replay()
+        self.closed = False
+        self._records = 0
+        # opened with the first record, so no empty journal is created
+        self._file = None
+
+    def replay(self):
+        """Labels by file name (last assignment wins)"""
+        labels = {}
+        if self.path.is_file():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    name, sep, label = line.rstrip("\n").rpartition(";")
+                    if not sep:
+                        # incomplete last line of a crashed session
+                        continue
+                    if label:
+                        labels[name] = label
+                    else:
+                        labels.pop(name, None)
+        return labels
+
+    def record(self, name, label):
+        if self.closed:
+            return
+        if label:
+            self.labels[name] = label
+        else:
+            self.labels.pop(name, None)
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(f"{name};{label or ''}\n")
+        self._file.flush()
+        self._records += 1
+        if self._records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Rewrite journal with the current state only"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(f"{k};{v}\n" for k, v in sorted(self.labels.items())))
+        os.replace(tmp, self.path)
+        self._records = 0
+
+    def close(self):
+        if self.closed:
+            return
+        if self._file is not None:
+            self.compact()
+        self.closed = True
+
+
 class ItemList(object):
+    """Image paths with a compact label array and running label counts
+
+    Labels are stored as one byte per image (0: unlabeled) and assigned
+    through set_label(), which keeps the per-label counts up to date, so
+    progress stats are O(1) per keystroke. Items are created on access.
+    Paths can be added from another thread with extend() while the list is
+    in use; sort() orders them once indexing is complete.
+    """
+
     def __init__(self, items=[], size=(299, 299)):
-        self._data = deque([Item(i, size) for i in items])
-        self._initial = True
+        self._lock = threading.RLock()
+        self._paths = []
+        self._labels = bytearray()
+        self._counts = {}
+        self._classified = 0
+        self._pos = 0
+        self._restore = {}
+        self.size = size
+        self.extend(items)
 
     def __iter__(self):
-        return iter(self._data)
+        with self._lock:
+            return iter([self._item(i) for i in range(len(self._paths))])
 
     def __len__(self):
-        return len(self._data)
+        return len(self._paths)
 
     def __repr__(self):
-        return ", ".join([str(x) for x in self._data])
+        return ", ".join([str(x) for x in self])
+
+    def _item(self, i):
+        label = self._labels[i]
+        return Item(self._paths[i], self.size, chr(label) if label else None)
+
+    def extend(self, paths):
+        with self._lock:
+            start = len(self._paths)
+            self._paths.extend(paths)
+            self._labels.extend(bytes(len(self._paths) - start))
+            if self._restore:
+                for i in range(start, len(self._paths)):
+                    label = self._restore.get(self._paths[i].name)
+                    if label:
+                        self._set(i, label)
+
+    def restore(self, labels):
+        """Apply saved labels by file name (also to items added later)"""
+        with self._lock:
+            self._restore = dict(labels)
+            for i, path in enumerate(self._paths):
+                label = self._restore.get(path.name)
+                if label:
+                    self._set(i, label)
+
+    def first_unlabeled(self):
+        """Move to the first item without label"""
+        with self._lock:
+            i = self._labels.find(0)
+            if i >= 0:
+                self._pos = i
+
+    def sort(self):
+        """Sort items by path, keeping labels and the current item"""
+        with self._lock:
+            if not self._paths:
+                return
+            order = sorted(range(len(self._paths)), key=self._paths.__getitem__)
+            self._pos = order.index(self._pos)
+            self._paths = [self._paths[i] for i in order]
+            self._labels = bytearray(self._labels[i] for i in order)
 
     def forward(self):
-        self._data.rotate(-1)
+        with self._lock:
+            if self._paths:
+                self._pos = (self._pos + 1) % len(self._paths)
 
     def backward(self):
-        self._data.rotate(1)
+        with self._lock:
+            if self._paths:
+                self._pos = (self._pos - 1) % len(self._paths)
 
     @property
     def current(self):
-        if len(self._data) > 0:
-            return self._data[0]
+        with self._lock:
+            if len(self._paths) > 0:
+                return self._item(self._pos)
+
+    def _set(self, i, label):
+        old = self._labels[i]
+        if old:
+            self._counts[chr(old)] -= 1
+            self._classified -= 1
+        if label:
+            self._counts[label] = self._counts.get(label, 0) + 1
+            self._classified += 1
+        self._labels[i] = ord(label) if label else 0
+
+    def set_label(self, label):
+        """Assign label to current item (None removes the label)"""
+        with self._lock:
+            self._set(self._pos, label)
+
+    def neighbours(self, n):
+        """The next n items, followed by the previous n items"""
+        with self._lock:
+            size = len(self._paths)
+            if size == 0:
+                return []
+            n = min(n, size // 2)
+            offsets = list(range(1, n + 1)) + list(range(-1, -n - 1, -1))
+            return [self._item((self._pos + i) % size) for i in offsets]
+
+    def rows(self):
+        """(path, label) of all items sorted by path, "?" if unlabeled"""
+        with self._lock:
+            rows = [
+                (p, chr(x) if x else "?") for p, x in zip(self._paths, self._labels)
+            ]
+        return sorted(rows)
 
     @property
     def labels(self):
-        return [x.label for x in self._data]
+        with self._lock:
+            return [chr(x) if x else None for x in self._labels]
+
+    @property
+    def counts(self):
+        """Number of items per label"""
+        with self._lock:
+            return {k: v for k, v in sorted(self._counts.items()) if v > 0}
+
+    @property
+    def no_classified(self):
+        return self._classified
+
+
+def write_report(path, rows, parquet=False):
+    """Write (file, rank) rows as csv in one go (and optionally as parquet)"""
+    with open(path, "w") as f:
+        f.write("file;rank\n" + "".join(f"{p};{r}\n" for p, r in rows))
+
+    if parquet:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("Writing parquet reports requires pyarrow (pip install pyarrow)")
+            return
+        table = pa.table(
+            {"file": [str(p) for p, _ in rows], "rank": [r for _, r in rows]}
+        )
+        pq.write_table(table, str(Path(path).with_suffix(".parquet")))
 
 
 class AppTk(tk.Frame):
@@ -100,9 +382,26 @@ class AppTk(tk.Frame):
             OUTFOLDER = Path(OUTFOLDER)
 
         NOCOPY = kwargs["nocopy"]
+        PREFETCH = kwargs.get("prefetch", 5)
+        FAST = kwargs.get("fast", True)
+        MODE = kwargs.get("mode", "copy")
+        WORKERS = kwargs.get("workers", 4)
+        LAYOUT = kwargs.get("layout", "flat")
+        PARQUET = kwargs.get("parquet", False)
 
         # remove these kwargs before passing them into tk frame
-        [kwargs.pop(e) for e in ["infolder", "outfolder", "nocopy"]]
+        for e in [
+            "infolder",
+            "outfolder",
+            "nocopy",
+            "prefetch",
+            "fast",
+            "mode",
+            "workers",
+            "layout",
+            "parquet",
+        ]:
+            kwargs.pop(e, None)
 
         tk.Frame.__init__(self, parent, **kwargs)
         self.parent = parent
@@ -110,18 +409,40 @@ class AppTk(tk.Frame):
         # bind keys
         self.parent.bind("<Key>", self.callback)
 
-        files = list(it.chain(*[INFOLDER.glob(f"*.{x}") for x in suffixes]))
-
-        self.filelist = sorted(set(files))
-        if len(self.filelist) == 0:
-            print("No files in infolder.")
+        # labels of an earlier (possibly crashed) session
+        self.journal = LabelJournal(str(INFOLDER).replace(" ", "_") + "_labels.journal")
+
+        # index folder in the background, show first image as soon as possible
+        # (when resuming a session only after the complete folder is indexed)
+        self.images = ItemList(size=(299, 299))
+        self.images.restore(self.journal.labels)
+        self.resuming = len(self.journal.labels) > 0
+        self.indexing = True
+        self.index_error = None
+        self._indexed = threading.Event()
+        threading.Thread(target=self._index, args=(INFOLDER,), daemon=True).start()
+        self._indexed.wait()
+        if len(self.images) == 0:
+            if self.index_error is None:
+                print("No files in infolder.")
             exit(-1)
 
-        self.images = ItemList(items=sorted(set(files)), size=(299, 299))
-
         self.outfolder = OUTFOLDER
         self.infolder = INFOLDER
         self.nocopy = NOCOPY
+        self.layout = LAYOUT
+        self.parquet = PARQUET
+
+        # clean images are copied (linked, moved) in the background
+        self.transfer = None
+        if not NOCOPY:
+            self.transfer = TransferPool(OUTFOLDER, mode=MODE, workers=WORKERS)
+
+        # decoded images around the current position
+        self.prefetch = PREFETCH
+        self.cache = ImageCache(
+            size=(299, 299), capacity=max(32, 4 * PREFETCH + 1), fast=FAST
+        )
 
         # basic setup
         self.setup()
@@ -132,6 +453,33 @@ class AppTk(tk.Frame):
 
         # show first image
         self.display()
+        self.after(250, self._poll_index)
+
+    def _index(self, folder):
+        """Scan folder in batches (runs in a background thread)"""
+        try:
+            for i, paths in enumerate(scan_images(folder)):
+                if i == 0:
+                    # sorted first batch, so small folders keep their order
+                    paths.sort()
+                self.images.extend(paths)
+                if not self.resuming:
+                    self._indexed.set()
+            self.images.sort()
+            if self.resuming:
+                self.images.first_unlabeled()
+        except Exception as e:
+            # labeling goes on with the images found so far
+            self.index_error = e
+            print(f"Could not index {folder}: {e}")
+        finally:
+            self.indexing = False
+            self._indexed.set()
+
+    def _poll_index(self):
+        self.print_titlebar()
+        if self.indexing:
+            self.after(250, self._poll_index)
 
     @property
     def cur_file(self):
@@ -139,7 +487,7 @@ class AppTk(tk.Frame):
 
     @property
     def no_classified(self):
-        return sum(1 for x in self.images.labels if x is not None)
+        return self.images.no_classified
 
     @property
     def no_total(self):
@@ -154,22 +502,45 @@ class AppTk(tk.Frame):
             return f"[ {label} ] "
 
         stats = f"{self.no_classified}/{self.no_total}"
+        if self.indexing:
+            stats += "+"
+        counts = " ".join(f"{k}:{v}" for k, v in self.images.counts.items())
         label = (
             f"FastClass :: {self.cur_file.image_path.name} - {get_class()} ({stats})"
         )
+        if counts:
+            label += f" | {counts}"
         return label
 
     def print_titlebar(self):
         self.parent.title(self.title)
 
-    def button_callback(self, button):
-        self.images.current.label = button
+    def assign(self, label):
+        """Label current image, journal it and move on"""
+        if self.journal.closed:
+            # saving, labels are final
+            return
+        self.images.set_label(label)
+        image_path = self.images.current.image_path
+        self.journal.record(image_path.name, label)
+        if self.transfer is not None:
+            self.transfer.place(image_path, self.subfolder(label))
         self.display_next()
 
+    def subfolder(self, label):
+        """Output subfolder for label (None: not part of the clean set)"""
+        if label == "d":
+            return None
+        if self.layout == "class":
+            return label if label and label != "?" else "unlabeled"
+        return ""
+
+    def button_callback(self, button):
+        self.assign(button)
+
     def callback(self, event=None):
         def button_action(char):
-            self.images.current.label = char
-            self.display_next()
+            self.assign(char)
 
         e = event.keysym
         if e in digits + "d":
@@ -186,28 +557,41 @@ class AppTk(tk.Frame):
             pass
 
     def save_and_exit(self):
-        # write report file
-        rows_all, rows_clean = [], []
-        for f in self.images:
-            row = (f.image_path, f.label if f.label else "?")
+        if self.journal.closed:
+            return
+        # no more labels while the clean set is written
+        self.parent.unbind("<Key>")
 
-            if f.label is not "d":
-                rows_clean.append(row)
-            rows_all.append(row)
+        # write report files
+        rows_all = self.images.rows()
+        rows_clean = [row for row in rows_all if row[1] != "d"]
 
         for ftype, rows in zip(["all", "clean"], [rows_all, rows_clean]):
             foutname = Path(
                 str(self.infolder).replace(" ", "_") + f"_report_{ftype}.csv"
             )
-            with open(foutname, "w") as f:
-                f.write("file;rank\n")
-                for row in sorted(rows, key=lambda x: x[0]):
-                    f.write(";".join([str(x) for x in row]) + "\n")
+            write_report(foutname, rows, parquet=self.parquet)
 
-        if not self.nocopy:
-            for r in rows_clean:
-                shutil.copy(r[0], self.outfolder)
+        self.journal.close()
 
+        if self.transfer is not None:
+            # unlabeled images are part of the clean set, too
+            for image_path, label in rows_all:
+                self.transfer.place(image_path, self.subfolder(label))
+            self.transfer.flush()
+            self._wait_for_transfers()
+        else:
+            self.parent.destroy()
+
+    def _wait_for_transfers(self):
+        """Show progress of outstanding copies, exit when done"""
+        pending = self.transfer.pending
+        if pending > 0:
+            self.parent.title(f"FastClass :: saving, {pending} files left ...")
+            self.after(100, self._wait_for_transfers)
+            return
+        for src, e in self.transfer.errors:
+            print(f"Could not write {src}: {e}")
         self.parent.destroy()
 
     def setup(self):
@@ -227,11 +611,15 @@ class AppTk(tk.Frame):
             ).grid(in_=self.lfdata, column=6 + i % 2, row=i // 2, sticky="w")
 
     def display(self):
-        photoimage = self.images.current.show()
+        photoimage = self.images.current.show(self.cache)
         self.Canvas.config(image=photoimage)
         self.Canvas.image = photoimage
         self.print_titlebar()
 
+        if self.prefetch > 0:
+            neighbours = self.images.neighbours(self.prefetch)
+            self.cache.prefetch([x.image_path for x in neighbours])
+
     def display_next(self):
         self.images.forward()
         self.display()
@@ -241,11 +629,32 @@ class AppTk(tk.Frame):
         self.display()
 
 
-def main(INFOLDER, OUTFOLDER, nocopy):
+def main(
+    INFOLDER,
+    OUTFOLDER,
+    nocopy,
+    prefetch=5,
+    fast=True,
+    mode="copy",
+    workers=4,
+    layout="flat",
+    parquet=False,
+):
     root = tk.Tk()
     root.title("FastClass")
 
-    app = AppTk(root, infolder=INFOLDER, outfolder=OUTFOLDER, nocopy=nocopy)
+    app = AppTk(
+        root,
+        infolder=INFOLDER,
+        outfolder=OUTFOLDER,
+        nocopy=nocopy,
+        prefetch=prefetch,
+        fast=fast,
+        mode=mode,
+        workers=workers,
+        layout=layout,
+        parquet=parquet,
+    )
 
     app.grid(row=0, column=0, columnspan=8, rowspan=6)
     app.configure(background="gray90")
@@ -280,12 +689,53 @@ click.Context.get_usage = click.Context.get_help
     show_default=True,
     help="disable filecopy for cleaned image set",
 )
+@click.option(
+    "--fast/--quality",
+    default=True,
+    show_default=True,
+    help="draft mode jpeg decoding for the preview (--quality: full decode)",
+)
+@click.option(
+    "--layout",
+    default="flat",
+    type=click.Choice(["flat", "class"]),
+    show_default=True,
+    help="outfolder layout (class: one subfolder per label)",
+)
+@click.option(
+    "--mode",
+    default="copy",
+    type=click.Choice(MODES),
+    show_default=True,
+    help="how clean images are placed in outfolder",
+)
+@click.option(
+    "--parquet",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="also write reports as parquet files (requires pyarrow)",
+)
+@click.option(
+    "--prefetch",
+    default=5,
+    show_default=True,
+    type=int,
+    help="number of images decoded ahead (and behind) in the background",
+)
 @click.argument("infolder", type=click.Path(exists=True), required=True)
 @click.argument("outfolder", type=click.Path(exists=False), required=False)
-def cli(infolder, outfolder, nocopy):
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    type=int,
+    help="number of background threads writing the clean image set",
+)
+def cli(infolder, outfolder, nocopy, **kwargs):
     """FastClass fcc"""
 
-    main(infolder, outfolder, nocopy)
+    main(infolder, outfolder, nocopy, **kwargs)
 
 
 if __name__ == "__main__":
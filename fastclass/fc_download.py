@@ -3,12 +3,9 @@
 # fastclass - fc_download.py
 #
 # Christian Werner, 2018-10-23
-#
-# TODO:
-#  - print report (images per class etc)
-#  - check if we need grace periods to avoid blocking
 
 import click
+from concurrent.futures import ThreadPoolExecutor
 import glob
 from icrawler import ImageDownloader
 from icrawler.builtin import (
@@ -20,13 +17,21 @@ from icrawler.builtin import (
 import logging
 import os
 import shutil
-import tempfile
-from typing import List, Dict
+import threading
+from typing import Dict, List, Optional, Tuple
 
 from .deduplicate import remove_dups
 from .googleparserfix import GoogleParser
+from .hashindex import HashIndex
+from .export import FORMATS, create_exporter
 from .imageprocessing import resize
+from .manifest import Manifest
 from .misc import sanitize_searchstring
+from .report import RunReport
+from .sessions import PooledSessions
+from .streaming import StreamProcessor
+from .urlfilter import URLFilter
+from .validate import check_image
 
 EPILOG = """::: FastClass fcd :::\r
 \r
@@ -38,15 +43,240 @@ Example: fcd -c GOOGLE -c BING -s 224 example/guitars.csv
 """
 
 
-class ImageLog:
-    """Dummy class to attach registry of source urls to ImageDownloader"""
+class SourceRegistry(object):
+    """Thread-safe registry of source urls and statistics for one crawl
+
+    A new registry is created for every class (and released once the class
+    is written), so memory is bounded by maxnum x crawlers. Besides the file
+    name -> url mapping it counts urls, bytes, failures, urls skipped
+    before the download (see URLFilter) and invalid downloads (moved to
+    quarantine, see check_image) per engine. With
+    keep_sources=False (streaming mode, the sink keeps the urls) only the
+    statistics are recorded.
+    """
+
+    def __init__(self, keep_sources: bool = True):
+        self.keep_sources = keep_sources
+        self._lock = threading.Lock()
+        self._sources: Dict[str, str] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._quarantine: List[Tuple[str, str, str]] = []
+
+    def __len__(self):
+        return len(self._sources)
+
+    def _engine(self, engine: str) -> Dict[str, int]:
+        return self._stats.setdefault(
+            engine, {"urls": 0, "bytes": 0, "failures": 0, "skipped": 0, "invalid": 0}
+        )
+
+    def add(self, engine: str, filename: str, url: str, nbytes: int = 0):
+        with self._lock:
+            stats = self._engine(engine)
+            stats["urls"] += 1
+            stats["bytes"] += nbytes
+            if self.keep_sources:
+                self._sources[filename] = url
+
+    def failed(self, engine: str):
+        with self._lock:
+            self._engine(engine)["failures"] += 1
+
+    def skipped(self, engine: str):
+        with self._lock:
+            self._engine(engine)["skipped"] += 1
+
+    def quarantine(self, engine: str, filename: str, url: str, reason: str):
+        with self._lock:
+            self._engine(engine)["invalid"] += 1
+            self._quarantine.append((filename, url, reason))
+
+    def quarantined(self) -> List[Tuple[str, str, str]]:
+        """(file name, source url, reason) of invalid downloads"""
+        with self._lock:
+            return sorted(self._quarantine)
+
+    def sources(self) -> Dict[str, str]:
+        """Copy of file name -> source url mapping"""
+        with self._lock:
+            return dict(self._sources)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per engine counts of urls, bytes, failures, skipped urls and
+        invalid images"""
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._sources.clear()
+            self._stats.clear()
+            self._quarantine.clear()
+
+
+class CustomDownloader(ImageDownloader):
+    # attached per crawler instance by _crawl_engine()
+    engine = None
+    registry = None
+    # optional StreamProcessor receiving each completed download
+    sink = None
+    # optional URLFilter shared by all engines (and classes)
+    urls = None
+    # minimum image size of the crawler (checked again after download)
+    min_size = None
+
+    def get_filename(self, task, default_ext):
+        # engines share the folder and may overshoot max_num by a few
+        # files, so each one gets its own prefix
+        name = super().get_filename(task, default_ext)
+        return f"{self.engine.lower()}_{name}" if self.engine else name
+
+    def download(self, task, default_ext, timeout=5, max_retry=3, **kwargs):
+        url = task["file_url"]
+        if self.urls is not None:
+            reason = None
+            if not self.urls.claim(url):
+                reason = "duplicate url"
+            else:
+                reason = self.urls.precheck(
+                    self.session, url, kwargs.get("min_size"), timeout
+                )
+            if reason is not None:
+                task.update(success=False, filename=None, skipped=reason)
+                return
 
-    registry = {}
+        super().download(task, default_ext, timeout, max_retry, **kwargs)
 
+        if self.urls is not None and task["filename"] is None:
+            # give other engines the chance to fetch it
+            self.urls.release(url)
 
-class CustomDownloader(ImageDownloader, ImageLog):
     def process_meta(self, task):
-        ImageLog.registry[task["filename"]] = task["file_url"]
+        if task["filename"] is None:
+            if self.registry is not None:
+                if task.get("skipped"):
+                    self.registry.skipped(self.engine)
+                else:
+                    self.registry.failed(self.engine)
+            return
+
+        path = os.path.join(self.storage.root_dir, task["filename"])
+
+        # validate right away (headers only), so broken files never reach
+        # dedup and resize
+        reason = check_image(path, self.min_size)
+        if reason is not None:
+            quarantine = self.storage.root_dir + ".quarantine"
+            os.makedirs(quarantine, exist_ok=True)
+            os.replace(path, os.path.join(quarantine, task["filename"]))
+            if self.registry is not None:
+                self.registry.quarantine(
+                    self.engine, task["filename"], task["file_url"], reason
+                )
+            return
+
+        if self.registry is not None:
+            try:
+                nbytes = os.path.getsize(path)
+            except OSError:
+                nbytes = 0
+            self.registry.add(self.engine, task["filename"], task["file_url"], nbytes)
+        if self.sink is not None:
+            self.sink.put(path, task["file_url"])
+
+
+class AdaptiveDownloader(CustomDownloader):
+    """CustomDownloader fetching through shared PooledSessions
+
+    Requests go through a keep-alive session per host whose concurrency
+    is adapted to latency and errors (backing off on 429/5xx), so the
+    downloader can run more threads than a fixed setup safely allows.
+    """
+
+    def __init__(self, thread_num, signal, session, storage, pool=None):
+        super().__init__(thread_num, signal, session, storage)
+        if pool is not None:
+            if not pool.headers:
+                pool.headers.update(session.headers)
+            self.session = pool
+
+
+def _crawl_engine(
+    engine: str,
+    folder: str,
+    search: str,
+    maxnum: int,
+    file_idx_offset: int,
+    registry: SourceRegistry,
+    sink: Optional[StreamProcessor] = None,
+    urls: Optional[URLFilter] = None,
+    pool: Optional[PooledSessions] = None,
+):
+    """Run a single crawler engine"""
+
+    def downloader(threads: int) -> Dict:
+        if pool is None:
+            return dict(downloader_cls=CustomDownloader, downloader_threads=threads)
+        # the per host limits decide how many threads actually download
+        return dict(
+            downloader_cls=AdaptiveDownloader,
+            downloader_threads=pool.maximum,
+            extra_downloader_args={"pool": pool},
+        )
+
+    if engine == "GOOGLE":
+        crawler = GoogleImageCrawler(
+            parser_cls=GoogleParser,
+            log_level=logging.CRITICAL,
+            feeder_threads=1,
+            parser_threads=1,
+            storage={"root_dir": folder},
+            **downloader(4),
+        )
+        kwargs = dict(keyword=search, min_size=(200, 200), max_size=None)
+
+    elif engine == "BING":
+        crawler = BingImageCrawler(
+            log_level=logging.CRITICAL,
+            storage={"root_dir": folder},
+            **downloader(4),
+        )
+        kwargs = dict(keyword=search, filters=None)
+
+    elif engine == "BAIDU":
+        crawler = BaiduImageCrawler(
+            log_level=logging.CRITICAL,
+            storage={"root_dir": folder},
+            **downloader(1),
+        )
+        kwargs = dict(keyword=search, min_size=(200, 200), max_size=None)
+
+    elif engine == "FLICKR":
+        crawler = FlickrImageCrawler(
+            os.environ.get("FLICKR_API_KEY"),
+            log_level=logging.CRITICAL,
+            storage={"root_dir": folder},
+            **downloader(1),
+        )
+        kwargs = dict(text=search, min_size=(200, 200), max_size=None)
+
+    else:
+        raise ValueError(f"Unknown crawler {engine}")
+
+    crawler.downloader.engine = engine
+    crawler.downloader.registry = registry
+    crawler.downloader.sink = sink
+    crawler.downloader.urls = urls
+    crawler.downloader.min_size = kwargs.get("min_size")
+    crawler.crawl(offset=0, max_num=maxnum, file_idx_offset=file_idx_offset, **kwargs)
+
+
+def _check_crawlers(crawlers: List[str]):
+    if "FLICKR" in crawlers and not os.environ.get("FLICKR_API_KEY"):
+        raise ValueError(
+            "Flickr crawler requires FLICKR_API_KEY environment variable"
+            " to be set with your non-secret API key."
+        )
 
 
 def crawl(
@@ -54,9 +284,24 @@ def crawl(
     search: str,
     maxnum: int,
     crawlers: [List[str]] = ["GOOGLE", "BING", "BAIDU", "FLICKR"],
+    limiter: Optional[threading.Semaphore] = None,
+    sink: Optional[StreamProcessor] = None,
+    registry: Optional[SourceRegistry] = None,
+    urls: Optional[URLFilter] = None,
+    pool: Optional[PooledSessions] = None,
 ) -> Dict[str, str]:
-    """Crawl web sites for images"""
-    print("(1) Crawling ...")
+    """Crawl web sites for images
+
+    The engines run concurrently, each one writing file names with its own
+    prefix. An optional (shared) limiter caps the number of running engines.
+    With a sink, every completed download is handed over immediately. Pass
+    a registry to access per engine statistics afterwards. A URLFilter
+    skips urls that another engine (or class) already fetched. With a pool,
+    images are fetched by AdaptiveDownloader.
+    """
+    _check_crawlers(crawlers)
+
+    print(f"(1) Crawling {', '.join(crawlers)} ...")
     # prepare folders
     os.makedirs(folder, exist_ok=True)
 
@@ -64,150 +309,454 @@ def crawl(
         print("Max num limited to 1000")
         maxnum = 1000
 
-    for c in crawlers:
-        print(f"    -> {c}")
-        if c == "GOOGLE":
-            google_crawler = GoogleImageCrawler(
-                downloader_cls=CustomDownloader,
-                parser_cls=GoogleParser,
-                log_level=logging.CRITICAL,
-                feeder_threads=1,
-                parser_threads=1,
-                downloader_threads=4,
-                storage={"root_dir": folder},
+    if limiter is None:
+        limiter = threading.Semaphore(len(crawlers))
+
+    if registry is None:
+        registry = SourceRegistry(keep_sources=sink is None)
+
+    def run(engine, file_idx_offset):
+        with limiter:
+            _crawl_engine(
+                engine,
+                folder,
+                search,
+                maxnum,
+                file_idx_offset,
+                registry,
+                sink,
+                urls,
+                pool,
             )
 
-            google_crawler.crawl(
-                keyword=search,
-                offset=0,
-                max_num=maxnum,
-                min_size=(200, 200),
-                max_size=None,
-                file_idx_offset=0,
-            )
+    with ThreadPoolExecutor(max_workers=max(len(crawlers), 1)) as executor:
+        futures = [executor.submit(run, c, i * maxnum) for i, c in enumerate(crawlers)]
+        for future in futures:
+            future.result()
 
-        if c == "BING":
-            bing_crawler = BingImageCrawler(
-                downloader_cls=CustomDownloader,
-                log_level=logging.CRITICAL,
-                downloader_threads=4,
-                storage={"root_dir": folder},
-            )
-            bing_crawler.crawl(
-                keyword=search,
-                filters=None,
-                offset=0,
-                max_num=maxnum,
-                file_idx_offset="auto",
-            )
+    return registry.sources()
 
-        if c == "BAIDU":
-            baidu_crawler = BaiduImageCrawler(
-                downloader_cls=CustomDownloader,
-                log_level=logging.CRITICAL,
-                storage={"root_dir": folder},
-            )
-            baidu_crawler.crawl(
-                keyword=search,
-                offset=0,
-                max_num=maxnum,
-                min_size=(200, 200),
-                max_size=None,
-                file_idx_offset="auto",
-            )
 
-        if c == "FLICKR":
-            flick_api_key = os.environ.get("FLICKR_API_KEY")
-            if not flick_api_key:
-                print(
-                    "Error: Flickr crawler requires FLICKR_API_KEY environment variable"
-                    " to be set with your non-secret API key."
+def _process_class(
+    search_term: str,
+    out_name: str,
+    tmp: str,
+    outpath: str,
+    crawler: List[str],
+    maxnum: int,
+    size: Tuple[int, int],
+    workers: int,
+    dedup: str,
+    threshold: int,
+    hash_index: Optional[HashIndex],
+    limiter: threading.Semaphore,
+    stream: int = 0,
+    keep: bool = False,
+    resume: bool = False,
+    fast: bool = False,
+    exporter=None,
+    report: Optional[RunReport] = None,
+    urls: Optional[URLFilter] = None,
+    pool: Optional[PooledSessions] = None,
+) -> Dict[str, str]:
+    """Crawl, deduplicate and resize the images of one class
+
+    With stream > 0 downloads are processed on arrival through a queue of
+    that depth instead of after all crawlers have finished. With resume,
+    leftovers of an interrupted earlier attempt at the class are removed
+    first. Stage timings and counts go to report. Returns the source urls
+    of the output files.
+    """
+    if report is None:
+        report = RunReport()
+
+    raw_folder = os.path.join(tmp, out_name)
+
+    out_resized = os.path.join(outpath, out_name)
+    if resume:
+        # the class is crawled again from scratch: icrawler skips existing
+        # file names, which would leave images without a source url
+        for path in [raw_folder, raw_folder + ".quarantine", out_resized]:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+    os.makedirs(out_resized, exist_ok=True)
+
+    registry = SourceRegistry(keep_sources=stream <= 0)
+
+    if stream > 0:
+        processor = StreamProcessor(
+            out_resized,
+            size=size,
+            depth=stream,
+            workers=max(workers, 1),
+            method=dedup,
+            threshold=threshold,
+            index=hash_index,
+            label=out_name,
+            keep=keep,
+            fast=fast,
+            exporter=exporter,
+        )
+        try:
+            # downloads are resized while crawling, the stages overlap
+            with report.stage(out_name, "crawl"):
+                crawl(
+                    raw_folder,
+                    search_term,
+                    maxnum,
+                    crawlers=crawler,
+                    limiter=limiter,
+                    sink=processor,
+                    registry=registry,
+                    urls=urls,
+                    pool=pool,
                 )
-                exit(-1)
-
-            flickr_crawler = FlickrImageCrawler(
-                flick_api_key,
-                downloader_cls=CustomDownloader,
-                log_level=logging.CRITICAL,
-                storage={"root_dir": folder},
+        finally:
+            with report.stage(out_name, "process"):
+                source_urls = processor.close()
+        report.update(
+            out_name,
+            images=processor.images,
+            duplicates=processor.duplicates,
+            skipped=processor.skipped,
+        )
+    else:
+        with report.stage(out_name, "crawl"):
+            source_urls = crawl(
+                raw_folder,
+                search_term,
+                maxnum,
+                crawlers=crawler,
+                limiter=limiter,
+                registry=registry,
+                urls=urls,
+                pool=pool,
             )
-            flickr_crawler.crawl(
-                text=search,
-                offset=0,
-                max_num=maxnum,
-                min_size=(200, 200),
-                max_size=None,
-                file_idx_offset="auto",
+        downloaded = len(glob.glob(raw_folder + "/*"))
+        with report.stage(out_name, "dedup"):
+            remove_dups(
+                raw_folder,
+                method=dedup,
+                threshold=threshold,
+                index=hash_index,
+                label=out_name,
             )
 
-    return {k: v for k, v in CustomDownloader.registry.items() if k is not None}
+        # resize
+        files = sorted(glob.glob(raw_folder + "/*"))
 
+        resize_stats = {}
+        with report.stage(out_name, "resize"):
+            source_urls = resize(
+                files,
+                outpath=out_resized,
+                size=size,
+                urls=source_urls,
+                workers=workers,
+                index=hash_index,
+                label=out_name,
+                fast=fast,
+                exporter=exporter,
+                stats=resize_stats,
+            )
+        report.update(
+            out_name,
+            images=resize_stats["images"],
+            duplicates=downloaded - len(files) + resize_stats["known"],
+            skipped=resize_stats["skipped"],
+        )
 
-def main(
-    infile: str, size: int, crawler: List[str], keep: bool, maxnum: int, outpath: str
-):
+    report.engines(out_name, registry.stats())
+    for engine, stats in sorted(registry.stats().items()):
+        print(
+            f"    {engine}: {stats['urls']} images"
+            f" ({stats['bytes'] / 2**20:.1f} MB), {stats['failures']} failures,"
+            f" {stats['skipped']} urls skipped, {stats['invalid']} invalid"
+        )
+
+    # list of invalid downloads (kept in <tmp>/<class>.quarantine)
+    quarantined = registry.quarantined()
+    if quarantined:
+        with open(out_resized + ".quarantine.csv", "w", encoding="utf-8") as log:
+            log.write("image,source,reason\n")
+            for item in quarantined:
+                log.write(",".join(item) + "\n")
+
+    # write report file
+    with open(out_resized + ".log", "w", encoding="utf-8") as log:
+        log.write("image,source\n")
+        for item in source_urls or {}:
+            log.write(",".join([item, source_urls[item]]) + "\n")
+
+    # release the url mapping of this class
+    registry.clear()
+
+    return source_urls or {}
+
+
+def print_summary(summary: Dict):
+    """Print images and stage timings per class of a run report"""
+    print("(3) Summary")
+    for label, c in sorted(summary["classes"].items()):
+        if c.get("resumed"):
+            print(f"    {label}: {c.get('images', 0)} images (earlier run)")
+            continue
+        stages = ", ".join(f"{k} {v:.1f}s" for k, v in c["stages"].items())
+        print(
+            f"    {label}: {c.get('images', 0)} images, {c.get('invalid', 0)} invalid,"
+            f" {c.get('duplicates', 0)} duplicates, {c.get('skipped', 0)} skipped"
+            + (f" ({stages})" if stages else "")
+        )
+    t = summary["totals"]
+    print(
+        f"    total: {t['images']} images in {t['seconds']:.1f}s"
+        f" ({t['images_per_s']:.1f} images/s)"
+    )
+
+
+def read_classes(infile) -> List[Tuple[str, Optional[str]]]:
+    """(search term, terms to remove for the folder name) per line of a
+    class csv file (the first line is a header)"""
+    classes = []
+    for lcnt, line in enumerate(infile):
+        if lcnt > 0:
+            no_cols = line[:-1].count(",") + 1
+            if no_cols > 1:
+                search_term, remove_terms = line[:-1].split(",")
+            else:
+                search_term = line[:-1]
+                remove_terms = None
+            classes.append((search_term, remove_terms))
+    return classes
+
+
+def run(
+    classes: List[Tuple[str, Optional[str]]],
+    size: int,
+    crawler: List[str],
+    keep: bool,
+    maxnum: int,
+    outpath: str,
+    workers: int = 1,
+    dedup: str = "md5",
+    threshold: int = 4,
+    index: str = None,
+    jobs: int = 1,
+    concurrency: int = 4,
+    stream: int = 0,
+    resume: bool = False,
+    fast: bool = False,
+    export: Optional[str] = None,
+    shard_size: int = 1000,
+    events: Optional[str] = None,
+    precheck: bool = False,
+    min_bytes: int = 0,
+    adaptive: bool = False,
+    overwrite: bool = False,
+) -> Dict:
+    """Crawl, deduplicate and resize classes into outpath (fcd without CLI)
+
+    classes are (search term, remove terms) pairs, see read_classes. Never
+    prompts or exits: an existing outpath is replaced with overwrite,
+    continued with resume and raises FileExistsError otherwise. Returns
+    the run report summary.
+    """
     if "ALL" in crawler:
         crawler = ["GOOGLE", "BING"]
+    _check_crawlers(crawler)
+
+    # raw downloads are kept until the run completes, so an interrupted
+    # run can be resumed
+    partial_path = outpath + ".partial"
+    manifest_path = outpath + ".manifest.json"
+    report_path = outpath + ".report.json"
+
+    if os.path.isdir(outpath) and not resume:
+        if not overwrite:
+            raise FileExistsError(f'Directory "{outpath}" exists')
+        shutil.rmtree(outpath)
+        if os.path.isdir(outpath + ".raw"):
+            shutil.rmtree(outpath + ".raw")
+    if not resume:
+        # leftovers of an earlier run do not belong to a fresh one
+        if os.path.isdir(partial_path):
+            shutil.rmtree(partial_path)
+        if os.path.isfile(manifest_path):
+            os.remove(manifest_path)
+
+    os.makedirs(outpath, exist_ok=resume)
+    print(f"INFO: final dataset will be located in {outpath}")
 
-    if os.path.isdir(outpath):
-        print(
-            f'Directory "{outpath}" exists. Would you like to overwrite the directory?'
-            " [y/n]"
+    manifest = Manifest(manifest_path)
+
+    exporter = None
+    if export:
+        export_path = outpath + f".{export}"
+        if os.path.isdir(export_path):
+            shutil.rmtree(export_path)
+        exporter = create_exporter(
+            export, export_path, (size, size), shard_size=shard_size
         )
-        choice = input().lower()
-        while choice != "y" and not "n":
-            print("Please reply with 'y' or 'n'")
-            choice = input().lower()
-        if choice == "y":
-            shutil.rmtree(outpath)
-            if os.path.isdir(outpath + ".raw"):
-                shutil.rmtree(outpath + ".raw")
-        else:
-            exit(-1)
+        print(f"INFO: packed dataset will be located in {export_path}")
 
-    os.makedirs(outpath)
-    print(f"INFO: final dataset will be located in {outpath}")
+    hash_index = HashIndex(index) if index else None
 
-    with tempfile.TemporaryDirectory() as tmp:
-        classes = []
+    report = RunReport(events)
 
-        for lcnt, line in enumerate(infile):
-            if lcnt > 0:
-                no_cols = line[:-1].count(",") + 1
-                if no_cols > 1:
-                    search_term, remove_terms = line[:-1].split(",")
-                else:
-                    search_term = line[:-1]
-                    remove_terms = None
-                classes.append((search_term, remove_terms))
+    # urls are fetched only once per run (across engines and classes)
+    urls = URLFilter(precheck=precheck or min_bytes > 0, min_bytes=min_bytes)
+    if resume:
+        for entry in manifest.classes.values():
+            urls.update(entry.get("sources", {}).values())
 
-        SIZE = (size, size)
-        for i, (search_term, remove_terms) in enumerate(classes):
-            print(f"[{i+1}/{len(classes)}] Searching: >> {search_term} <<")
-            out_name = sanitize_searchstring(search_term, rstring=remove_terms)
-            raw_folder = os.path.join(tmp, out_name)
+    pool = PooledSessions() if adaptive else None
 
-            source_urls = crawl(raw_folder, search_term, maxnum, crawlers=crawler)
-            remove_dups(raw_folder)
+    # global cap of concurrently running crawler engines (all classes)
+    limiter = threading.BoundedSemaphore(max(concurrency, 1))
 
-            # resize
-            out_resized = os.path.join(outpath, out_name)
-            os.makedirs(out_resized, exist_ok=True)
+    tmp = partial_path
+    os.makedirs(tmp, exist_ok=True)
 
-            files = sorted(glob.glob(raw_folder + "/*"))
+    try:
+        SIZE = (size, size)
 
-            source_urls = resize(
-                files, outpath=out_resized, size=SIZE, urls=source_urls
-            )
+        def process(i, search_term, remove_terms):
+            out_name = sanitize_searchstring(search_term, rstring=remove_terms)
+            if resume and manifest.is_complete(out_name):
+                print(f"[{i+1}/{len(classes)}] Complete: >> {search_term} <<")
+                files = manifest.classes[out_name]["files"]
+                report.update(
+                    out_name, search=search_term, images=len(files), resumed=True
+                )
+                if exporter is not None:
+                    entry = manifest.classes[out_name]
+                    for name in entry["files"]:
+                        path = os.path.join(outpath, out_name, name)
+                        exporter.add(path, out_name, entry["sources"].get(name))
+                return
 
-            # write report file
-            with open(out_resized + ".log", "w", encoding="utf-8") as log:
-                log.write("image,source\n")
-                for item in source_urls:
-                    log.write(",".join([item, source_urls[item]]) + "\n")
+            print(f"[{i+1}/{len(classes)}] Searching: >> {search_term} <<")
+            report.begin(out_name, search_term)
+            sources = _process_class(
+                search_term,
+                out_name,
+                tmp,
+                outpath,
+                crawler,
+                maxnum,
+                SIZE,
+                workers,
+                dedup,
+                threshold,
+                hash_index,
+                limiter,
+                stream,
+                keep,
+                resume,
+                fast,
+                exporter,
+                report,
+                urls,
+                pool,
+            )
+            report.end(out_name)
+            files = os.listdir(os.path.join(outpath, out_name))
+            manifest.complete(out_name, search_term, files, sources)
+
+        # classes are processed concurrently, so post-processing (dedup,
+        # resize) of one class overlaps with the downloads of others
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            futures = [
+                executor.submit(process, i, search_term, remove_terms)
+                for i, (search_term, remove_terms) in enumerate(classes)
+            ]
+            for future in futures:
+                future.result()
+
+        report.attach(
+            "urls",
+            {
+                "seen": len(urls),
+                "duplicates": urls.duplicates,
+                "rejected": urls.rejected,
+            },
+        )
+        if urls.duplicates or urls.rejected:
+            print(
+                f"INFO: skipped {urls.duplicates} urls seen before,"
+                f" {urls.rejected} rejected by the pre-check"
+            )
+        if pool is not None:
+            hosts = pool.stats()
+            report.attach("hosts", hosts)
+            print(
+                f"INFO: adaptive downloads from {len(hosts)} hosts,"
+                f" {sum(h['backoffs'] for h in hosts.values())} backoffs"
+            )
+        summary = report.write(report_path)
+        print_summary(summary)
+        print(f"INFO: run report written to {report_path}")
 
         if keep:
-            shutil.copytree(tmp, outpath + ".raw")
+            if os.path.isdir(outpath + ".raw"):
+                shutil.rmtree(outpath + ".raw")
+            shutil.move(tmp, outpath + ".raw")
+        else:
+            shutil.rmtree(tmp)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        report.close()
+        if pool is not None:
+            pool.close()
+        if hash_index is not None:
+            hash_index.close()
+
+    return summary
+
+
+def main(
+    infile: str,
+    size: int,
+    crawler: List[str],
+    keep: bool,
+    maxnum: int,
+    outpath: str,
+    resume: bool = False,
+    **kwargs,
+):
+    """fcd: asks before replacing outpath, options as for run()"""
+    overwrite = False
+    if os.path.isdir(outpath) and not resume:
+        print(
+            f'Directory "{outpath}" exists. Would you like to overwrite the directory?'
+            " [y/n]"
+        )
+        choice = input().lower()
+        while choice not in ("y", "n"):
+            print("Please reply with 'y' or 'n'")
+            choice = input().lower()
+        if choice != "y":
+            exit(-1)
+        overwrite = True
+
+    try:
+        _check_crawlers(crawler)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(-1)
+
+    run(
+        read_classes(infile),
+        size,
+        crawler,
+        keep,
+        maxnum,
+        outpath,
+        resume=resume,
+        overwrite=overwrite,
+        **kwargs,
+    )
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -215,6 +764,14 @@ click.Context.get_usage = click.Context.get_help
 
 
 @click.command(context_settings=CONTEXT_SETTINGS, epilog=EPILOG)
+@click.option(
+    "-a",
+    "--adaptive",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="pooled keep-alive downloads with per host adaptive concurrency",
+)
 @click.option(
     "-c",
     "--crawler",
@@ -224,6 +781,57 @@ click.Context.get_usage = click.Context.get_help
     multiple=True,
     help="selection of crawler (multiple invocations supported)",
 )
+@click.option(
+    "--concurrency",
+    default=4,
+    show_default=True,
+    type=int,
+    help="max. number of crawler engines running at the same time (all classes)",
+)
+@click.option(
+    "-d",
+    "--dedup",
+    default="md5",
+    type=click.Choice(["md5", "ahash", "dhash", "phash"]),
+    show_default=True,
+    help="duplicate detection (md5: identical files, *hash: perceptual hashes)",
+)
+@click.option(
+    "-e",
+    "--export",
+    default=None,
+    type=click.Choice(FORMATS),
+    help="also write a packed dataset (tar shards or uint8 array)",
+)
+@click.option(
+    "--events",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="stream progress events (json lines) to this file",
+)
+@click.option(
+    "-f",
+    "--fast",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="faster draft mode jpeg decoding when resizing (slightly lower quality)",
+)
+@click.option(
+    "-i",
+    "--index",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="sqlite hash index shared across classes and runs (skips known images)",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    show_default=True,
+    type=int,
+    help="number of classes processed concurrently",
+)
 @click.option(
     "-k",
     "--keep",
@@ -240,6 +848,51 @@ click.Context.get_usage = click.Context.get_help
     type=int,
     help="maximum number of images per crawler (lower is faster, 1000 is max)",
 )
+@click.option(
+    "--shard-size",
+    default=1000,
+    show_default=True,
+    type=int,
+    help="number of images per tar shard (--export tar)",
+)
+@click.option(
+    "--stream",
+    default=0,
+    show_default=True,
+    type=int,
+    help="process downloads on arrival through a queue of this depth (0: off)",
+)
+@click.option(
+    "-t",
+    "--threshold",
+    default=4,
+    show_default=True,
+    type=int,
+    help="max. hamming distance of perceptual hashes to count as duplicate",
+)
+@click.option(
+    "--min-bytes",
+    default=0,
+    show_default=True,
+    type=int,
+    help="skip images smaller than this before downloading (implies --precheck)",
+)
+@click.option(
+    "-p",
+    "--precheck",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="read image headers first and skip undersized images",
+)
+@click.option(
+    "-r",
+    "--resume",
+    default=False,
+    is_flag=True,
+    show_default=True,
+    help="resume an interrupted run (skip completed classes)",
+)
 @click.option(
     "-s",
     "--size",
@@ -255,9 +908,17 @@ click.Context.get_usage = click.Context.get_help
     show_default=True,
     help="name of output directory",
 )
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    show_default=True,
+    type=int,
+    help="number of processes for resizing (0 uses all cores)",
+)
 @click.argument("infile", type=click.File("r"), required=True)
-def cli(infile, size, crawler, keep, maxnum, outpath):
-    main(infile, size, crawler, keep, maxnum, outpath)
+def cli(infile, size, crawler, keep, maxnum, outpath, **kwargs):
+    main(infile, size, crawler, keep, maxnum, outpath, **kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# fastclass - fileops.py
+#
+# Copy, link or move files into an output folder in the background
+
+import errno
+import os
+from pathlib import Path
+import queue
+import shutil
+import threading
+from typing import Dict, Optional
+
+# linux ioctl to clone a file (copy-on-write), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+MODES = ["copy", "hardlink", "reflink", "move"]
+
+
+def reflink(src: str, dst: str):
+    """Clone src to dst sharing its data blocks (btrfs, xfs, ...)"""
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def transfer(src: str, dst: str, mode: str = "copy"):
+    """Place src at dst by copy, hardlink, reflink or move
+
+    hardlink and reflink fall back to a copy if the file system (or the
+    platform) does not support them.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if mode == "move":
+        shutil.move(src, dst)
+        return
+
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+    elif mode == "reflink":
+        try:
+            reflink(src, dst)
+            return
+        except (OSError, ImportError):
+            pass
+
+    shutil.copy(src, dst)
+
+
+class TransferPool(object):
+    """Worker threads keeping an output folder in sync with labels
+
+    place(src, subfolder) puts src into outfolder/subfolder ("" for the
+    output folder itself), place(src, None) removes it again (e.g. when an
+    image is relabeled for deletion). Requests for the same file are applied
+    in order, only the latest one counts. In move mode nothing happens until
+    flush(), as the source files are still needed for display.
+    """
+
+    def __init__(self, outfolder: str, mode: str = "copy", workers: int = 4):
+        self.outfolder = Path(outfolder)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._desired: Dict[Path, Optional[Path]] = {}
+        self._placed: Dict[Path, Optional[Path]] = {}
+        self._busy = set()
+        self._queue = queue.Queue()
+        self._deferred = mode == "move"
+        self.errors = []
+        for _ in range(max(workers, 1)):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def place(self, src: Path, subfolder: Optional[str] = ""):
+        src = Path(src)
+        dst = None if subfolder is None else self.outfolder / subfolder / src.name
+        with self._lock:
+            if self._desired.get(src) == dst:
+                return
+            self._desired[src] = dst
+            if self._deferred or src in self._busy:
+                return
+            self._busy.add(src)
+        self._queue.put(src)
+
+    def _outstanding(self):
+        return [k for k, v in self._desired.items() if self._placed.get(k) != v]
+
+    @property
+    def pending(self) -> int:
+        """Number of files whose requested state is not reached yet"""
+        with self._lock:
+            return len(self._outstanding())
+
+    def flush(self):
+        """Start deferred (move) requests, returns immediately"""
+        with self._lock:
+            self._deferred = False
+            todo = [k for k in self._outstanding() if k not in self._busy]
+            self._busy.update(todo)
+        for src in todo:
+            self._queue.put(src)
+
+    def _apply(self, src: Path, old: Optional[Path], new: Optional[Path]):
+        if old is not None and os.path.lexists(old):
+            os.remove(old)
+        if new is not None:
+            new.parent.mkdir(parents=True, exist_ok=True)
+            transfer(str(src), str(new), self.mode)
+
+    def _work(self):
+        while True:
+            src = self._queue.get()
+            while True:
+                with self._lock:
+                    old, new = self._placed.get(src), self._desired[src]
+                    if old == new:
+                        self._busy.discard(src)
+                        break
+                try:
+                    self._apply(src, old, new)
+                except OSError as e:
+                    self.errors.append((src, e))
+                    new = None
+                with self._lock:
+                    self._placed[src] = new
+                    if new is None:
+                        # give up on this file, do not retry forever
+                        self._desired[src] = None
@@ -1,29 +1,38 @@
 # Fix for changes in Google API Feb/March 2020
 # Proposed fix by here: https://github.com/hellock/icrawler/issues/65#issuecomment-614135227
+#
+# The result page is scanned as bytes: only the AF_initDataCallback block
+# with key ds:1 is searched for image urls, no html tree is built.
 
-from bs4 import BeautifulSoup
 from icrawler import Parser
 import re
+from typing import List
+
+_CALLBACK = b"AF_initDataCallback"
+_SCRIPT_END = b"</script>"
+
+# image url: no whitespace, quotes or tags, bounded length
+_IMAGE_URL = re.compile(rb"https?://[^\s\"'<>]{1,2048}?\.(?:jpg|png|bmp)")
+
+
+def extract_urls(content: bytes) -> List[str]:
+    """Unique image urls of the ds:1 data block of a google result page"""
+    start = content.find(_CALLBACK)
+    while start >= 0:
+        end = content.find(_SCRIPT_END, start)
+        if end < 0:
+            end = len(content)
+        if (
+            content.find(b"ds:1", start, end) >= 0
+            and content.find(b"ds:0", start, end) < 0
+        ):
+            urls = _IMAGE_URL.finditer(content, start, end)
+            uris = dict.fromkeys(m.group().decode("utf-8", "ignore") for m in urls)
+            return list(uris)
+        start = content.find(_CALLBACK, end)
+    return []
 
 
 class GoogleParser(Parser):
     def parse(self, response):
-        soup = BeautifulSoup(response.content.decode("utf-8", "ignore"), "lxml")
-        # image_divs = soup.find_all('script')
-        image_divs = soup.find_all(name="script")
-        for div in image_divs:
-            # txt = div.text
-            txt = str(div)
-            # if not txt.startswith('AF_initDataCallback'):
-            if "AF_initDataCallback" not in txt:
-                continue
-            if "ds:0" in txt or "ds:1" not in txt:
-                continue
-            # txt = re.sub(r"^AF_initDataCallback\({.*key: 'ds:(\d)'.+data:function\(\){return (.+)}}\);?$",
-            #             "\\2", txt, 0, re.DOTALL)
-            # meta = json.loads(txt)
-            # data = meta[31][0][12][2]
-            # uris = [img[1][3][0] for img in data if img[0] == 1]
-
-            uris = re.findall(r"http.*?\.(?:jpg|png|bmp)", txt)
-            return [{"file_url": uri} for uri in uris]
+        return [{"file_url": uri} for uri in extract_urls(response.content)]
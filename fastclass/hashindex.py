@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# fastclass - hashindex.py
+#
+# Persistent content-hash index shared across classes and fcd runs
+
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+from .deduplicate import hashfile
+
+
+class HashIndex(object):
+    """SQLite backed index of image content hashes
+
+    Maps the md5 of a raw (downloaded) file to the class label and the
+    output file it was processed into. remove_dups and resize consult it to
+    drop images that already exist in another class or from an earlier run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests: Dict[Tuple[str, int, float], str] = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images "
+            "(digest TEXT PRIMARY KEY, label TEXT, path TEXT)"
+        )
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def digest(self, path: str) -> str:
+        """Content hash of file (memoized by path, size and mtime)"""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = hashfile(path)
+            self._digests[key] = digest
+        return digest
+
+    def lookup(self, digest: str) -> Optional[Tuple[str, str]]:
+        """Return (label, output path) for digest"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT label, path FROM images WHERE digest = ?", (digest,)
+            ).fetchone()
+
+    def known(
+        self, digest: str, exclude_label: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        """Like lookup, but only if the indexed output file still exists
+
+        Entries of exclude_label are ignored, so a resumed class does not
+        treat its own earlier outputs as duplicates.
+        """
+        entry = self.lookup(digest)
+        if entry and entry[0] != exclude_label and os.path.exists(entry[1]):
+            return entry
+        return None
+
+    def add(self, digest: str, label: str, path: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?)",
+                (digest, label, os.path.abspath(path)),
+            )
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
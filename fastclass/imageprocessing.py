@@ -4,7 +4,10 @@
 #
 # Christian Werner, 2018-10-27
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
+import threading
 from PIL import Image
 import piexif
 import piexif.helper
@@ -12,14 +15,171 @@ import piexif.helper
 from tqdm import tqdm
 from typing import Any, Dict, List, Optional, Tuple
 
+# number of images resized per job for array exports (numpy path)
+BATCH = 32
+
+# per thread buffer reused by _resize_batch (resize() may run in threads)
+_local = threading.local()
+
+
+def source_exif(url: str) -> bytes:
+    """Create exif block with source url stored as UserComment"""
+    tag_data = piexif.helper.UserComment.dump("source: " + url)
+    return piexif.dump({"Exif": {piexif.ExifIFD.UserComment: tag_data}})
+
+
+def _output_name(f: str) -> str:
+    """Name of the resized output file for input file f"""
+    fname, _ = os.path.splitext(os.path.basename(f))
+    return fname + ".jpg"
+
+
+def thumbnail(file_name: str, size: Tuple[int, int], fast: bool = False) -> Any:
+    """Read image and shrink it to fit into size
+
+    With fast, the JPEG decoder already scales by 1/2, 1/4 or 1/8 (DCT
+    scaling via Image.draft) as long as the image stays larger than size,
+    and only the remaining reduction uses the antialias filter.
+    """
+    im = Image.open(file_name)
+    if fast:
+        im.draft(im.mode, size)
+    im.thumbnail(size, Image.ANTIALIAS)
+    return im
+
+
+def letterbox(shape: Tuple[int, int], size: Tuple[int, int]) -> Tuple[int, int]:
+    """Offset (x, y) that centers an image of shape in a canvas of size"""
+    return int((size[0] - shape[0]) / 2), int((size[1] - shape[1]) / 2)
+
+
+def _rgb(im: Any) -> Any:
+    return im if im.mode == "RGB" else im.convert("RGB")
+
+
+def pad_batch(
+    files: List[str], size: Tuple[int, int], fast: bool = False, out: Any = None
+) -> Tuple[Any, List[bool]]:
+    """Thumbnail files and letterbox them into a uint8 array (requires numpy)
+
+    out (shape (n, height, width, 3), white padding) is allocated if not
+    given. Returns out and a flag per file, False for unreadable files.
+    """
+    import numpy as np
+
+    if out is None:
+        out = np.empty((len(files), size[1], size[0], 3), dtype=np.uint8)
+    ok = []
+    for row, f in zip(out, files):
+        try:
+            im = _rgb(thumbnail(f, size, fast))
+            pixels = np.asarray(im)
+        except OSError:
+            ok.append(False)
+            continue
+        (x, y), (w, h) = letterbox(im.size, size), im.size
+        row[:y] = 255
+        row[y + h :] = 255
+        row[y : y + h, :x] = 255
+        row[y : y + h, x + w :] = 255
+        row[y : y + h, x : x + w] = pixels
+        ok.append(True)
+    return out, ok
+
+
+def _save(im: Any, out: str, url: Optional[str] = None):
+    if url:
+        # embed source in image (built in memory, written with a single encode)
+        im.save(out, exif=source_exif(url))
+    else:
+        im.save(out)
+
+
+def _resize_batch(
+    files: List[str],
+    outpath: str,
+    size: Tuple[int, int],
+    urls: List[Optional[str]],
+    fast: bool = False,
+    pixels: bool = False,
+) -> Tuple[List[Optional[str]], Any]:
+    """Resize a chunk of images via a reused buffer (see pad_batch)
+
+    Returns the output names (None if skipped) and, with pixels, a copy
+    of the padded images.
+    """
+    import numpy as np
+
+    shape = (len(files), size[1], size[0], 3)
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or buffer.shape[0] < shape[0] or buffer.shape[1:] != shape[1:]:
+        buffer = _local.buffer = np.empty(shape, dtype=np.uint8)
+    data, ok = pad_batch(files, size, fast, buffer[: len(files)])
+
+    names = []
+    for row, f, url, valid in zip(data, files, urls, ok):
+        name = None
+        if valid:
+            name = _output_name(f)
+            _save(Image.fromarray(row), os.path.join(outpath, name), url)
+        names.append(name)
+    return names, data.copy() if pixels else None
+
+
+def resize_file(
+    f: str,
+    outpath: str,
+    size: Tuple[int, int],
+    url: Optional[str] = None,
+    fast: bool = False,
+) -> Optional[str]:
+    """Resize a single image, return name of output file (None if skipped)"""
+    should_resize = size[0] > 0 and size[1] > 0
+
+    try:
+        if should_resize:
+            im = thumbnail(f, size, fast)
+            # paste straight into an RGB canvas (no RGBA intermediate)
+            bg = Image.new("RGB", size, (255, 255, 255))
+            bg.paste(_rgb(im), letterbox(im.size, size))
+        else:
+            bg = _rgb(Image.open(f))
+    except OSError:
+        # skip truncated files
+        return None
+
+    out = os.path.join(outpath, _output_name(f))
+    _save(bg, out, url)
+    return os.path.basename(out)
+
 
 def resize(
     files: List[str],
     outpath: Optional[str] = None,
     size: Tuple[int, int] = (299, 299),
     urls: Optional[Dict[str, str]] = None,
+    workers: int = 1,
+    index=None,
+    label: Optional[str] = None,
+    fast: bool = False,
+    exporter=None,
+    stats: Optional[Dict[str, int]] = None,
 ) -> Optional[Dict[str, str]]:
-    """Resize image to specified size"""
+    """Resize image to specified size
+
+    With workers > 1 (or 0 for all cores) images are processed in a pool of
+    worker processes (started via forkserver or spawn, so scripts calling
+    resize need an "if __name__ == '__main__'" guard). The returned
+    sources keep the order of files.
+    With a HashIndex, files already in the index (as another class) are
+    skipped and the new outputs are recorded under label.
+    fast enables draft mode JPEG decoding (see thumbnail). Every output is
+    also passed to exporter (see fastclass.export), if given.
+    For an array exporter, images are resized in chunks of BATCH into a
+    reused numpy array (see pad_batch) that feeds the export directly.
+    A stats dict, if given, receives the number of output images, of files
+    skipped as unreadable and of files already in the index.
+    """
     should_resize = size[0] > 0 and size[1] > 0
     if should_resize:
         print(f"(2) Resizing images to {size}")
@@ -30,57 +190,119 @@ def resize(
     if urls:
         sources = {}
 
+    known = 0
+    if index is not None:
+        todo = [f for f in files if not index.known(index.digest(f), label)]
+        known = len(files) - len(todo)
+        if len(todo) < len(files):
+            print(f"    skipping {len(files) - len(todo)} images already in index")
+        files = todo
+
+    jobs = [
+        (f, outpath, size, urls.get(os.path.basename(f)) if urls else None, fast)
+        for f in files
+    ]
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    results = [None] * len(jobs)
+
+    # pixels of array exports are taken from the resize buffer, everything
+    # else is pasted into one canvas per image (fewer copies)
+    batched = should_resize and hasattr(exporter, "add_pixels")
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        batched = False
+
+    if batched:
+        chunks = [
+            list(range(i, min(i + BATCH, len(jobs))))
+            for i in range(0, len(jobs), BATCH)
+        ]
+        tasks = [
+            (
+                _resize_batch,
+                [jobs[i][0] for i in chunk],
+                outpath,
+                size,
+                [jobs[i][3] for i in chunk],
+                fast,
+                True,
+            )
+            for chunk in chunks
+        ]
+    else:
+        chunks = [[i] for i in range(len(jobs))]
+        tasks = [(resize_file, *job) for job in jobs]
+
+    # chunks go to the exporter in order as soon as they are done, only
+    # chunks finished ahead of an earlier one are held back
+    finished = {}
+    exported = 0
+
+    def export(chunk, data):
+        for j, i in enumerate(chunk):
+            out, url = results[i], jobs[i][3]
+            if data is not None and out:
+                exporter.add_pixels(data[j], out, label, url)
+            elif out:
+                exporter.add(os.path.join(outpath, out), label, url)
+
+    def collect(n, result):
+        nonlocal exported
+        names, data = result if batched else ([result], None)
+        for i, name in zip(chunks[n], names):
+            results[i] = name
+        if exporter is None:
+            return
+        finished[n] = data
+        while exported in finished:
+            export(chunks[exported], finished.pop(exported))
+            exported += 1
+
     with tqdm(total=len(files)) as t:
-        for fcnt, f in enumerate(files):
-            im = Image.open(f)
-            if should_resize:
-                try:
-                    im.thumbnail(size, Image.ANTIALIAS)
-                except OSError:
-                    # skip truncated files
-                    continue
-
-                bg = Image.new("RGBA", size, (255, 255, 255, 0))
-                bg.paste(
-                    im,
-                    (int((size[0] - im.size[0]) / 2), int((size[1] - im.size[1]) / 2)),
-                )
-
-            else:
-                bg = im
-
-            try:
-                bg = bg.convert("RGB")
-            except OSError:
-                t.update(1)
-                continue
-
-            fname, _ = os.path.splitext(os.path.basename(f))
-            out = os.path.join(outpath, fname + ".jpg")
-            bg.save(out)
-
-            if urls:
-                # embed source in image
-                tag_data = piexif.helper.UserComment.dump(
-                    "source: " + urls[os.path.basename(f)]
-                )
-                exif_dict = piexif.load(out)
-                exif_dict["Exif"][piexif.ExifIFD.UserComment] = tag_data
-                exif_bytes = piexif.dump(exif_dict)
-                bg.save(out, exif=exif_bytes)
-
-                sources[os.path.basename(out)] = urls[os.path.basename(f)]
-
-            t.update(1)
+        if workers > 1 and len(tasks) > 1:
+            # no fork: callers (fcd) have crawler and monitor threads running
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=context
+            ) as executor:
+                futures = {executor.submit(*task): n for n, task in enumerate(tasks)}
+                for future in as_completed(futures):
+                    collect(futures[future], future.result())
+                    t.update(len(chunks[futures[future]]))
+        else:
+            for n, task in enumerate(tasks):
+                collect(n, task[0](*task[1:]))
+                t.update(len(chunks[n]))
+
+    if index is not None:
+        for f, out in zip(files, results):
+            if out:
+                index.add(index.digest(f), label, os.path.join(outpath, out))
+        index.commit()
+
+    if urls:
+        for (_, _, _, url, _), out in zip(jobs, results):
+            if out and url:
+                sources[out] = url
+
+    if stats is not None:
+        images = sum(1 for out in results if out)
+        stats.update(images=images, skipped=len(results) - images, known=known)
 
     return sources
 
 
-def image_pad(file_name: str, size: Tuple[int, int]) -> Any:
-    """Read image and pad"""
-    im = Image.open(file_name)
-    im.thumbnail(size, Image.ANTIALIAS)
+def image_pad(file_name: str, size: Tuple[int, int], fast: bool = False) -> Any:
+    """Read image and pad (transparent border, for display)"""
+    im = thumbnail(file_name, size, fast)
 
     bg = Image.new("RGBA", size, (255, 255, 255, 0))
-    bg.paste(im, (int((size[0] - im.size[0]) / 2), int((size[1] - im.size[1]) / 2)))
+    bg.paste(im, letterbox(im.size, size))
     return bg
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# fastclass - manifest.py
+#
+# Record of completed classes for resumable fcd runs
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+class Manifest(object):
+    """JSON manifest of the classes (files, source urls) an fcd run completed
+
+    The file is rewritten atomically after every completed class, so an
+    interrupted run can be resumed by skipping the classes listed here.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.classes: Dict[str, Dict] = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                self.classes = json.load(f).get("classes", {})
+
+    def __contains__(self, name: str) -> bool:
+        return self.is_complete(name)
+
+    def is_complete(self, name: str) -> bool:
+        with self._lock:
+            return self.classes.get(name, {}).get("complete", False)
+
+    def complete(
+        self,
+        name: str,
+        search: str,
+        files: List[str],
+        sources: Optional[Dict[str, str]] = None,
+    ):
+        """Mark class as complete and write manifest"""
+        with self._lock:
+            self.classes[name] = {
+                "search": search,
+                "complete": True,
+                "files": sorted(files),
+                "sources": sources or {},
+            }
+            self._write()
+
+    def _write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"classes": self.classes}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# fastclass - pipeline.py
+#
+# Library API of the fcd stages (crawl, dedup, resize, export)
+#
+# The stages import their dependencies when they are called: processing
+# stages never load icrawler or tkinter, and nothing prompts or exits.
+
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+DEFAULT_CRAWLERS = ["GOOGLE", "BING"]
+
+# image files picked up from folders (matched case-insensitive)
+SUFFIXES = {"jpg", "jpeg", "png", "tif", "tiff", "bmp", "gif"}
+
+Size = Union[int, Tuple[int, int]]
+
+
+def _size(size: Size) -> Tuple[int, int]:
+    return (size, size) if isinstance(size, int) else tuple(size)
+
+
+def images(folder: str) -> List[str]:
+    """Sorted paths of the image files in folder"""
+    with os.scandir(folder) as entries:
+        return sorted(
+            e.path
+            for e in entries
+            if e.is_file() and os.path.splitext(e.name)[1][1:].lower() in SUFFIXES
+        )
+
+
+def crawl(
+    search: str,
+    folder: str,
+    maxnum: int = 100,
+    crawlers: Sequence[str] = DEFAULT_CRAWLERS,
+    precheck: bool = False,
+    min_bytes: int = 0,
+    adaptive: bool = False,
+) -> Dict[str, str]:
+    """Download images for search into folder, returns file name -> url
+
+    Raises ValueError for an unusable crawler selection.
+    """
+    from .fc_download import crawl as crawl_engines
+    from .sessions import PooledSessions
+    from .urlfilter import URLFilter
+
+    urls = URLFilter(precheck=precheck or min_bytes > 0, min_bytes=min_bytes)
+    pool = PooledSessions() if adaptive else None
+    try:
+        return crawl_engines(
+            folder, search, maxnum, crawlers=list(crawlers), urls=urls, pool=pool
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def dedup(
+    folder: str,
+    method: str = "md5",
+    threshold: int = 4,
+    workers: int = 8,
+    index=None,
+    label: Optional[str] = None,
+) -> List[str]:
+    """Remove duplicate images from folder, returns the remaining files
+
+    index is an optional HashIndex (images known under another label are
+    removed as well).
+    """
+    from .deduplicate import remove_dups
+
+    remove_dups(
+        folder,
+        method=method,
+        threshold=threshold,
+        workers=workers,
+        index=index,
+        label=label,
+    )
+    return images(folder)
+
+
+def resize(
+    files: Union[str, List[str]],
+    outpath: str,
+    size: Size = 299,
+    sources: Optional[Dict[str, str]] = None,
+    workers: int = 1,
+    fast: bool = False,
+    index=None,
+    label: Optional[str] = None,
+    exporter=None,
+) -> Dict[str, str]:
+    """Resize files (or all images of a folder) into outpath
+
+    sources maps input file names to urls (embedded into the outputs).
+    Returns output file name -> url.
+    """
+    from .imageprocessing import resize as resize_files
+
+    if isinstance(files, str):
+        files = images(files)
+    os.makedirs(outpath, exist_ok=True)
+    result = resize_files(
+        files,
+        outpath=outpath,
+        size=_size(size),
+        urls=sources,
+        workers=workers,
+        index=index,
+        label=label,
+        fast=fast,
+        exporter=exporter,
+    )
+    return result or {}
+
+
+def _read_sources(path: str) -> Dict[str, str]:
+    """Output name -> url from a class log file written by fcd"""
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        rows = [line.rstrip("\n").split(",", 1) for line in f][1:]
+    return {row[0]: row[1] for row in rows if len(row) == 2}
+
+
+def export(
+    dataset: str,
+    dest: str,
+    fmt: str = "tar",
+    size: Optional[Size] = None,
+    shard_size: int = 1000,
+) -> int:
+    """Pack a dataset folder (one subfolder per class) into dest
+
+    fmt is "tar" or "array" (see fastclass.export); the image size of an
+    array export is taken from the first image unless given. Source urls
+    are read from the <class>.log files fcd writes. Returns the number of
+    exported images.
+    """
+    from .export import create_exporter
+
+    classes = sorted(
+        d.name for d in os.scandir(dataset) if d.is_dir() and images(d.path)
+    )
+    if size is None:
+        from PIL import Image
+
+        first = images(os.path.join(dataset, classes[0])) if classes else []
+        size = Image.open(first[0]).size if first else (0, 0)
+
+    exporter = create_exporter(fmt, dest, _size(size), shard_size=shard_size)
+    count = 0
+    try:
+        for label in classes:
+            sources = _read_sources(os.path.join(dataset, label + ".log"))
+            for path in images(os.path.join(dataset, label)):
+                exporter.add(path, label, sources.get(os.path.basename(path)))
+                count += 1
+    finally:
+        exporter.close()
+    return count
+
+
+def run(
+    classes: Iterable[Union[str, Tuple[str, Optional[str]]]],
+    outpath: str,
+    size: int = 299,
+    crawlers: Sequence[str] = DEFAULT_CRAWLERS,
+    maxnum: int = 100,
+    keep: bool = False,
+    overwrite: bool = False,
+    **kwargs,
+) -> Dict:
+    """All stages for classes, like fcd (options as for fc_download.run)
+
+    classes are search terms or (search term, terms to remove from the
+    folder name) pairs. Returns the run report summary.
+    """
+    from .fc_download import run as run_classes
+
+    classes = [(c, None) if isinstance(c, str) else tuple(c) for c in classes]
+    return run_classes(
+        classes,
+        size,
+        list(crawlers),
+        keep,
+        maxnum,
+        outpath,
+        overwrite=overwrite,
+        **kwargs,
+    )
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# fastclass - report.py
+#
+# Per class and per stage timings/counts of an fcd run
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# counters summed up over all classes
+TOTALS = [
+    "downloaded",
+    "bytes",
+    "failures",
+    "invalid",
+    "duplicates",
+    "skipped",
+    "images",
+]
+
+
+class RunReport(object):
+    """Thread-safe collection of stage timings and counts of an fcd run
+
+    Classes are entered with begin() and end(), stages are timed with the
+    stage() context manager and counts are added with update() (classes
+    with resumed=True are left out of the totals). With events, every step
+    is also appended to that file as a json line while the run is in
+    progress. summary() returns everything as a dict, write() as json.
+    """
+
+    def __init__(self, events: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._classes: Dict[str, Dict[str, Any]] = {}
+        self._extra: Dict[str, Any] = {}
+        self._events = open(events, "w", encoding="utf-8") if events else None
+
+    def event(self, kind: str, **fields):
+        """Append a json line event (no-op without events file)"""
+        if self._events is None:
+            return
+        line = json.dumps({"time": round(time.time(), 3), "event": kind, **fields})
+        with self._lock:
+            self._events.write(line + "\n")
+            self._events.flush()
+
+    def _entry(self, label: str) -> Dict[str, Any]:
+        return self._classes.setdefault(label, {"stages": {}})
+
+    def begin(self, label: str, search: str):
+        with self._lock:
+            self._entry(label).update(search=search, started=time.time())
+        self.event("class_start", label=label, search=search)
+
+    def end(self, label: str):
+        with self._lock:
+            entry = self._entry(label)
+            seconds = time.time() - entry.get("started", time.time())
+            entry["seconds"] = round(seconds, 3)
+            if seconds > 0 and "images" in entry:
+                entry["images_per_s"] = round(entry["images"] / seconds, 2)
+            if seconds > 0 and "bytes" in entry:
+                entry["mb_per_s"] = round(entry["bytes"] / 2**20 / seconds, 3)
+            counts = {k: entry[k] for k in TOTALS + ["seconds"] if k in entry}
+        self.event("class_end", label=label, **counts)
+
+    @contextmanager
+    def stage(self, label: str, name: str):
+        """Time the enclosed block as stage name of class label"""
+        t0 = time.time()
+        self.event("stage_start", label=label, stage=name)
+        try:
+            yield
+        finally:
+            seconds = round(time.time() - t0, 3)
+            with self._lock:
+                self._entry(label)["stages"][name] = seconds
+            self.event("stage_end", label=label, stage=name, seconds=seconds)
+
+    def update(self, label: str, **fields):
+        """Set counts (or other fields) of class label"""
+        with self._lock:
+            self._entry(label).update(fields)
+        self.event("update", label=label, **fields)
+
+    def engines(self, label: str, stats: Dict[str, Dict[str, int]]):
+        """Record per engine statistics (see SourceRegistry.stats)"""
+        self.update(
+            label,
+            engines=stats,
+            downloaded=sum(s["urls"] for s in stats.values()),
+            bytes=sum(s["bytes"] for s in stats.values()),
+            failures=sum(s["failures"] for s in stats.values()),
+            invalid=sum(s.get("invalid", 0) for s in stats.values()),
+        )
+
+    def attach(self, name: str, data: Any):
+        """Add a top level section (e.g. per host statistics) to the summary"""
+        with self._lock:
+            self._extra[name] = data
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {
+                k: {f: v for f, v in c.items() if f != "started"}
+                for k, c in self._classes.items()
+            }
+            extra = dict(self._extra)
+        seconds = time.time() - self._start
+        # classes completed by an earlier (resumed) run are not counted
+        done = [c for c in classes.values() if not c.get("resumed")]
+        totals = {k: sum(c.get(k, 0) for c in done) for k in TOTALS}
+        totals["seconds"] = round(seconds, 3)
+        totals["images_per_s"] = round(totals["images"] / seconds, 2)
+        stages = {}
+        for c in done:
+            for name, t in c["stages"].items():
+                stages[name] = round(stages.get(name, 0) + t, 3)
+        totals["stages"] = stages
+        return {"classes": classes, "totals": totals, **extra}
+
+    def write(self, path: str):
+        summary = self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        self.event("run_end", **summary["totals"])
+        return summary
+
+    def close(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# fastclass - sessions.py
+#
+# Keep-alive sessions and adaptive concurrency per image host
+
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# responses that ask us to slow down
+BACKOFF_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostLimiter(object):
+    """AIMD limit of concurrent requests to one host
+
+    Every successful request raises the limit by 1/limit (about +1 per
+    round of requests) unless its latency is well above the running
+    average. Errors, timeouts and 429/5xx responses halve the limit and
+    pause the host for the Retry-After time or an exponential delay.
+    """
+
+    def __init__(
+        self,
+        start: int = 4,
+        maximum: int = 16,
+        slow: float = 2.0,
+        delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.limit = float(start)
+        self.maximum = maximum
+        self.slow = slow
+        self.delay = delay
+        self.max_delay = max_delay
+        self.latency: Optional[float] = None
+        self.active = 0
+        self.requests = 0
+        self.errors = 0
+        self.backoffs = 0
+        self._failures = 0
+        self._resume = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._resume - time.monotonic()
+                if wait <= 0 and self.active < int(self.limit):
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.active += 1
+
+    def release(
+        self,
+        latency: float,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        """Account a finished request (status None: request failed)"""
+        with self._cond:
+            self.active -= 1
+            self.requests += 1
+            if status is None or status in BACKOFF_STATUS:
+                self.errors += 1
+                self.backoffs += 1
+                self._failures += 1
+                self.limit = max(1.0, self.limit / 2)
+                if retry_after is None:
+                    retry_after = self.delay * 2 ** (self._failures - 1)
+                pause = min(retry_after, self.max_delay)
+                self._resume = max(self._resume, time.monotonic() + pause)
+            else:
+                self._failures = 0
+                if self.latency is None or latency <= self.slow * self.latency:
+                    self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "latency": round(self.latency or 0, 3),
+                "requests": self.requests,
+                "errors": self.errors,
+                "backoffs": self.backoffs,
+            }
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
+
+
+class PooledSessions(object):
+    """Keep-alive requests sessions and a HostLimiter per host
+
+    Shared by the downloaders of all engines and classes, so one host is
+    throttled as a whole. get() waits for a free slot of the host, and
+    retries (after the backoff pause) on 429/5xx responses.
+    """
+
+    def __init__(self, start: int = 4, maximum: int = 16, retries: int = 2):
+        self.start = start
+        self.maximum = maximum
+        self.retries = retries
+        self.headers: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Any] = {}
+
+    def _host(self, url: str):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maximum)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                limiter = HostLimiter(self.start, self.maximum)
+                self._hosts[host] = (session, limiter)
+            return self._hosts[host]
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs):
+        session, limiter = self._host(url)
+        headers = {**self.headers, **(headers or {})}
+        for attempt in range(self.retries + 1):
+            limiter.acquire()
+            t0 = time.monotonic()
+            try:
+                response = session.get(url, headers=headers, **kwargs)
+            except Exception:
+                limiter.release(time.monotonic() - t0)
+                raise
+            status = response.status_code
+            limiter.release(time.monotonic() - t0, status, _retry_after(response))
+            if status not in BACKOFF_STATUS or attempt == self.retries:
+                return response
+            response.close()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Limit, latency and counts per host"""
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: limiter.stats() for host, (_, limiter) in sorted(hosts.items())}
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._hosts.values():
+                session.close()
+            self._hosts.clear()
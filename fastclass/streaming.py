@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# fastclass - streaming.py
+#
+# Resize and deduplicate downloaded images while the crawlers are running
+
+import os
+import queue
+import threading
+from typing import Dict, Optional, Tuple
+
+from tqdm import tqdm
+
+from .deduplicate import BKTree, HASHES, hashfile
+from .imageprocessing import resize_file
+
+_STOP = object()
+
+
+class StreamProcessor(object):
+    """Bounded queue of downloaded files that are processed on arrival
+
+    Downloader threads put (path, url) items into the queue. Consumer threads
+    drop duplicates (exact or perceptual, optionally against a HashIndex),
+    resize the remaining images into outpath and delete the raw file unless
+    keep is set. Since put() blocks while the queue is full, the number of
+    raw files on disk is bounded by depth (plus files in flight).
+    """
+
+    def __init__(
+        self,
+        outpath: str,
+        size: Tuple[int, int] = (299, 299),
+        depth: int = 32,
+        workers: int = 1,
+        method: str = "md5",
+        threshold: int = 4,
+        index=None,
+        label: Optional[str] = None,
+        keep: bool = False,
+        fast: bool = False,
+        exporter=None,
+    ):
+        self.outpath = outpath
+        self.size = size
+        self.method = method
+        self.threshold = threshold
+        self.index = index
+        self.label = label
+        self.keep = keep
+        self.fast = fast
+        self.exporter = exporter
+
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.sources: Dict[str, str] = {}
+        self.images = 0
+        self.duplicates = 0
+        self.skipped = 0
+
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._tree = BKTree()
+        self._progress = tqdm(desc="    processed", unit="img")
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(max(workers, 1))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def put(self, path: str, url: Optional[str] = None):
+        """Hand a completed download to the consumers (blocks if full)"""
+        self.queue.put((path, url))
+
+    def close(self) -> Dict[str, str]:
+        """Wait for outstanding files, return sources sorted by output name"""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._progress.close()
+        if self.index is not None:
+            self.index.commit()
+        print(
+            f"    {self.images} images, {self.duplicates} duplicates,"
+            f" {self.skipped} skipped"
+        )
+        return {k: self.sources[k] for k in sorted(self.sources)}
+
+    def _is_duplicate(self, path: str) -> bool:
+        digest = self.index.digest(path) if self.index else hashfile(path)
+        if self.method != "md5":
+            phash = HASHES[self.method](path)
+        with self._lock:
+            if digest in self._seen:
+                return True
+            if self.index is not None and self.index.known(digest, self.label):
+                return True
+            if self.method != "md5":
+                if self._tree.search(phash, self.threshold):
+                    return True
+                self._tree.add(phash, path)
+            self._seen.add(digest)
+        return False
+
+    def _process(self, path: str, url: Optional[str]):
+        try:
+            duplicate = self._is_duplicate(path)
+        except OSError:
+            # not an image (or truncated)
+            duplicate = None
+
+        out = None
+        if duplicate is False:
+            try:
+                out = resize_file(path, self.outpath, self.size, url, self.fast)
+            except OSError:
+                out = None
+
+        with self._lock:
+            if duplicate:
+                self.duplicates += 1
+            elif out is None:
+                self.skipped += 1
+            else:
+                self.images += 1
+                if url:
+                    self.sources[out] = url
+                if self.index is not None:
+                    digest = self.index.digest(path)
+                    self.index.add(digest, self.label, os.path.join(self.outpath, out))
+
+        if out and self.exporter is not None:
+            self.exporter.add(os.path.join(self.outpath, out), self.label, url)
+
+        if not self.keep or duplicate:
+            os.remove(path)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            try:
+                self._process(*item)
+            except Exception as e:
+                # never let a consumer die, the producers would block forever
+                print(f"    Warning: could not process {item[0]} ({e})")
+                with self._lock:
+                    self.skipped += 1
+            finally:
+                self._progress.update(1)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# fastclass - urlfilter.py
+#
+# Skip image urls before downloading them (seen before, too small)
+
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from PIL import ImageFile
+
+from .validate import too_small
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# bytes read by the header pre-check
+HEADER_BYTES = 65536
+
+
+def normalize_url(url: str) -> str:
+    """Key identifying the resource of url
+
+    Scheme (http/https), host case, default ports, fragments, tracking
+    parameters (utm_*) and the order of query parameters are ignored.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host += f":{parts.port}"
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.startswith("utm_")
+    )
+    key = host + (parts.path or "/")
+    if query:
+        key += "?" + urlencode(query)
+    return key
+
+
+def _image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Image dimensions from the first bytes of a file (None if unknown)"""
+    parser = ImageFile.Parser()
+    try:
+        parser.feed(data)
+    except Exception:
+        return None
+    return parser.image.size if parser.image else None
+
+
+class URLFilter(object):
+    """Thread-safe set of image urls shared by all engines and classes
+
+    claim(url) returns False if the (normalized) url was claimed before, so
+    the same image found by several engines or for several classes is only
+    fetched once. Failed downloads release() their url again. With
+    precheck, the first HEADER_BYTES of an image are requested (range
+    request, the connection is closed early) to reject images below
+    min_bytes or below the minimum size of the crawler before the full
+    transfer.
+    """
+
+    def __init__(self, precheck: bool = False, min_bytes: int = 0):
+        self.precheck_enabled = precheck
+        self.min_bytes = min_bytes
+        self._lock = threading.Lock()
+        self._seen = set()
+        self.duplicates = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def update(self, urls: Iterable[str]):
+        """Mark urls as seen (e.g. sources of an earlier run)"""
+        with self._lock:
+            self._seen.update(normalize_url(u) for u in urls)
+
+    def claim(self, url: str) -> bool:
+        key = normalize_url(url)
+        with self._lock:
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen.add(key)
+            return True
+
+    def release(self, url: str):
+        with self._lock:
+            self._seen.discard(normalize_url(url))
+
+    def precheck(
+        self,
+        session,
+        url: str,
+        min_size: Optional[Tuple[int, int]] = None,
+        timeout: int = 5,
+    ) -> Optional[str]:
+        """Reason to skip url based on its headers, None to download it"""
+        if not self.precheck_enabled:
+            return None
+
+        headers: Dict[str, str] = {"Range": f"bytes=0-{HEADER_BYTES - 1}"}
+        try:
+            response = session.get(url, headers=headers, timeout=timeout, stream=True)
+        except Exception:
+            # let the regular download handle (and report) it
+            return None
+
+        with response:
+            if response.status_code not in (200, 206):
+                return None
+            total = None
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = content_range.rpartition("/")[2]
+            else:
+                total = response.headers.get("Content-Length")
+            total = int(total) if total and total.isdigit() else None
+
+            data = b""
+            for chunk in response.iter_content(8192):
+                data += chunk
+                if len(data) >= HEADER_BYTES:
+                    break
+
+        reason = None
+        if total is not None and total < self.min_bytes:
+            reason = f"{total} bytes"
+        elif min_size:
+            size = _image_size(data)
+            if size and too_small(size, min_size):
+                reason = f"size {size[0]}x{size[1]}"
+        if reason:
+            with self._lock:
+                self.rejected += 1
+        return reason
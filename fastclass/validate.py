@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# fastclass - validate.py
+#
+# Cheap checks of downloaded images (headers and file end, decoded only
+# when the end marker is missing)
+
+import os
+from typing import Optional, Tuple
+
+from PIL import Image
+
+# modes resize() can convert to RGB
+MODES = {
+    "1",
+    "L",
+    "LA",
+    "P",
+    "PA",
+    "RGB",
+    "RGBA",
+    "RGBX",
+    "RGBa",
+    "CMYK",
+    "YCbCr",
+    "LAB",
+    "HSV",
+    "I",
+    "I;16",
+    "F",
+}
+
+# bytes that end the image data of a complete file (may be followed by
+# trailing data, e.g. maker trailers or an appended motion photo video)
+_TRAILERS = {
+    "JPEG": b"\xff\xd9",
+    "PNG": b"IEND\xaeB`\x82",
+    "GIF": b";",
+}
+
+
+def _truncated(path: str, fmt: str) -> bool:
+    trailer = _TRAILERS.get(fmt)
+    if trailer is None:
+        return False
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 1024, 0))
+        tail = f.read()
+    if len(trailer) == 1:
+        # a one byte marker only counts at the very end (padding ignored)
+        tail = tail.rstrip(b"\x00\r\n ")[-1:]
+    if trailer in tail:
+        return False
+    # no marker near the end (e.g. longer trailing data): decode to be sure
+    try:
+        with Image.open(path) as im:
+            im.load()
+    except Exception:
+        return True
+    return False
+
+
+def too_small(size: Tuple[int, int], min_size: Optional[Tuple[int, int]]) -> bool:
+    """size is below min_size (in either orientation)"""
+    if not min_size:
+        return False
+    return max(size) < max(min_size) or min(size) < min(min_size)
+
+
+def check_image(path: str, min_size: Optional[Tuple[int, int]] = None) -> Optional[str]:
+    """Reason why path is not a usable image, None if it looks fine
+
+    Only the header (format, size, mode) and the end of the file are read,
+    the image data is decoded only if the end marker is not found there.
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return "empty file"
+        with Image.open(path) as im:
+            fmt, size, mode = im.format, im.size, im.mode
+    except Image.DecompressionBombError:
+        return "too many pixels"
+    except (OSError, SyntaxError, ValueError):
+        return "not an image"
+
+    if size[0] <= 0 or size[1] <= 0:
+        return f"invalid size {size[0]}x{size[1]}"
+    if too_small(size, min_size):
+        return f"size {size[0]}x{size[1]}"
+    if mode not in MODES:
+        return f"mode {mode}"
+    if _truncated(path, fmt):
+        return "truncated"
+    return None